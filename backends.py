@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+import metrics
+import prompts
+import rules_engine
+
+# Classifier backends behind one async interface, so main doesn't care whether an answer
+# comes from the rules, a local Ollama model or Gemini. A spec like "rules,gemini" builds
+# a cascade: the rules answer first, and only answers less confident than
+# CONFIDENCE_THRESHOLD are passed on to the next, more expensive backend.
+
+logger = logging.getLogger('main')  # This should match the logger name from main.py
+
+CONFIDENCE_THRESHOLD = float(os.getenv("CONFIDENCE_THRESHOLD", "0.6"))
+# A model answer that contradicts the cheaper backend before it is only this confident
+DISAGREEMENT_FACTOR = 0.5
+
+# What a backend answered and how sure it is, 0 to 1
+Verdict = namedtuple("Verdict", ["insight", "confidence"])
+
+_loop = None
+_loop_lock = threading.Lock()
+_registry = {}
+
+
+def _background_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, daemon=True, name="backends").start()
+    return _loop
+
+
+def stage_of(insight):
+    match = prompts.ANSWER_PATTERN.search(insight or "")
+    return match.group(1).upper() if match else None
+
+
+class Backend(ABC):
+    """
+    A classifier. Subclasses implement classify(); callers use verdict() from async code
+    or generate_insight() from threads, which runs it on a shared background loop.
+    """
+    name = "backend"
+    max_concurrency = 1
+    is_model = True  # counted in llm_calls_total
+
+    @property
+    def key(self):
+        """Identifies the backend's answers in the insight cache."""
+        return self.name
+
+    @abstractmethod
+    async def classify(self, ticker, data, crossover_date=None, crossover_price=None):
+        """Returns a Verdict, with a None insight if there is no answer."""
+
+    async def verdict(self, ticker, data, crossover_date=None, crossover_price=None):
+        if self.is_model:
+            metrics.inc("llm_calls_total", model=self.name)
+        with metrics.timer("generate_insight_seconds", model=self.name):
+            return await self.classify(ticker, data, crossover_date, crossover_price)
+
+    def generate_insight(self, ticker, data, crossover_date=None, crossover_price=None):
+        """Classifies from any thread. Returns the insight text, or None if there is no answer."""
+        future = asyncio.run_coroutine_threadsafe(self.verdict(ticker, data, crossover_date, crossover_price), _background_loop())
+        return future.result().insight
+
+
+class RulesBackend(Backend):
+    name = "rules"
+    max_concurrency = 4
+    is_model = False
+
+    async def classify(self, ticker, data, crossover_date=None, crossover_price=None):
+        return Verdict(*rules_engine.assess(ticker, logger, data, crossover_date, crossover_price))
+
+
+class GeminiBackend(Backend):
+    name = "gemini"
+
+    def __init__(self, model=""):
+        import gemini
+        gemini.check_keys()  # fail when the backend is chosen, not on the first ticker
+        self.module = gemini
+        self.max_concurrency = gemini.MAX_CONCURRENCY
+
+    async def classify(self, ticker, data, crossover_date=None, crossover_price=None):
+        # The Gemini client is blocking, each call gets its own thread
+        insight = await asyncio.to_thread(self.module.generate_insight, ticker, logger, data, crossover_date, crossover_price)
+        return Verdict(insight, 1.0 if stage_of(insight) else 0.0)
+
+
+class OllamaBackend(Backend):
+    def __init__(self, model=""):
+        import ollama_llm
+        self.module = ollama_llm
+        self.model = model or ollama_llm.MODEL_NAME
+        self.name = f"ollama:{self.model}"
+        self.max_concurrency = ollama_llm.MAX_CONCURRENCY
+
+    async def classify(self, ticker, data, crossover_date=None, crossover_price=None):
+        # The Ollama client belongs to ollama_llm's own loop
+        future = asyncio.run_coroutine_threadsafe(
+            self.module.agenerate_insight(ticker, self.model, logger, data, crossover_date, crossover_price),
+            self.module._background_loop())
+        insight = await asyncio.wrap_future(future)
+        return Verdict(insight, 1.0 if stage_of(insight) else 0.0)
+
+
+class CascadeBackend(Backend):
+    """
+    Asks each backend in turn, cheapest first, and stops at the first answer at least
+    `threshold` confident. Backends that fail to answer fall through to the next, and if
+    none is confident enough the most confident answer wins, later backends on a tie.
+    """
+
+    def __init__(self, backends, threshold=CONFIDENCE_THRESHOLD):
+        self.backends = backends
+        self.threshold = threshold
+        self.name = ">".join(backend.name for backend in backends)
+        self.max_concurrency = max(backend.max_concurrency for backend in backends)
+
+    @property
+    def key(self):
+        # Which backend answers depends on the threshold too
+        return f"{self.name}@{self.threshold:g}"
+
+    async def verdict(self, ticker, data, crossover_date=None, crossover_price=None):
+        # Each backend asked records its own call, counting the cascade too would double them
+        return await self.classify(ticker, data, crossover_date, crossover_price)
+
+    async def classify(self, ticker, data, crossover_date=None, crossover_price=None):
+        answers = []
+        for i, backend in enumerate(self.backends):
+            if i:
+                metrics.inc("escalations_total", to=backend.name)
+            verdict = await backend.verdict(ticker, data, crossover_date, crossover_price)
+            if verdict.insight is None:
+                logger.info(f"{ticker}: no answer from {backend.name}")
+                continue
+            if answers and stage_of(verdict.insight) != stage_of(answers[-1].insight):
+                verdict = verdict._replace(confidence=verdict.confidence * DISAGREEMENT_FACTOR)
+            if verdict.confidence >= self.threshold:
+                return verdict
+            logger.info(f"{ticker}: {backend.name} answered {verdict.insight.strip()} with confidence {verdict.confidence:.2f}")
+            answers.append(verdict)
+        return max(reversed(answers), key=lambda answer: answer.confidence, default=Verdict(None, 0.0))
+
+
+def register(name, factory):
+    """Makes factory(model) available as `name` in backend specs."""
+    _registry[name] = factory
+
+
+def create(spec, model="", threshold=CONFIDENCE_THRESHOLD):
+    """
+    Builds the backend for a spec: one name ("rules", "ollama", "gemini"), or a comma
+    separated cascade ("rules,ollama,gemini"). A name may carry its own model after a
+    colon ("ollama:llama3.1:8b"), otherwise `model` is used. The old module names
+    (rules_engine, ollama_llm) are accepted too.
+    """
+    backends = []
+    for part in spec.split(","):
+        name, _, own_model = part.strip().partition(":")
+        if name not in _registry:
+            raise ValueError(f"Unknown classifier backend {name!r}, expected one of {', '.join(sorted(_registry))}")
+        backends.append(_registry[name](own_model or model))
+    return backends[0] if len(backends) == 1 else CascadeBackend(backends, threshold)
+
+
+register("rules", lambda model: RulesBackend())
+register("rules_engine", lambda model: RulesBackend())
+register("gemini", GeminiBackend)
+register("ollama", OllamaBackend)
+register("ollama_llm", OllamaBackend)
@@ -0,0 +1,166 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+import bar_store
+import indicators as ind
+import screener
+from bars import as_bar_array
+from ibkr import stop_pct_from_price
+
+# Replays the cached bars through the Stage 2 rules to judge a rule change in minutes
+# instead of weeks of paper positions. Signals are computed for the whole universe at
+# once on a dates x tickers panel, then the days are walked with every ticker's
+# position updated together.
+
+WINDOW = 83  # trading days in the "120 D" fetch main.py runs with, the window its filters see
+TRADE_COLUMNS = ["ticker", "open_date", "open_price", "stop_price", "close_date", "close_price",
+                 "reason", "shares", "days_held", "return_pct", "pnl"]
+
+
+def date_panel(bars_by_ticker):
+    """
+    Aligns every ticker's bars on the union of their dates. Halted days are carried
+    forward from the last close with no volume; days before a listing stay NaN.
+
+    Returns:
+        (tickers, dates, panel): panel maps open/high/low/close/volume to dates x tickers arrays.
+    """
+    tickers = [ticker for ticker, data in bars_by_ticker.items() if len(data)]
+    bars = [as_bar_array(bars_by_ticker[ticker]) for ticker in tickers]
+    dates = np.unique(np.concatenate([b.dates for b in bars])) if bars else np.array([], dtype=str)
+
+    fields = ("open", "high", "low", "close", "volume")
+    panel = {field: np.full((len(dates), len(tickers)), np.nan) for field in fields}
+    for column, b in enumerate(bars):
+        rows = np.searchsorted(dates, b.dates)
+        for field in fields:
+            panel[field][rows, column] = b.array[field]
+
+    # Carry the last close through gaps so a halt doesn't reset every rolling window
+    listed = ~np.isnan(panel["close"])
+    index = np.where(listed, np.arange(len(dates))[:, None], 0)
+    last = np.maximum.accumulate(index, axis=0)
+    closes = np.take_along_axis(panel["close"], last, axis=0)
+    gaps = ~listed & ~np.isnan(closes)
+    for field in ("open", "high", "low"):
+        panel[field][gaps] = closes[gaps]
+    panel["close"] = closes
+    panel["volume"][gaps] = 0
+    return tickers, dates, panel
+
+
+def run(bars_by_ticker, dollar_size_limit, trade_amount, window=WINDOW, liquidity_filter=None):
+    """
+    Simulates the live strategy on every ticker: open at the close of a Stage 2 breakout
+    that passes main.process_data's filters on the trailing `window` days (the liquidity
+    filter from main's LIQUIDITY_* settings, then screener's candidate rule), close at
+    the stop_pct_from_price stop (or the open if it gaps through) or at the close of the
+    day the failure rules reclassify the stock as Stage 1 or 4. Positions still open on
+    the last day are marked at its close. The breakout itself stands in for the model's
+    Stage 2 answer.
+
+    Returns:
+        DataFrame of trades with TRADE_COLUMNS, in close order.
+    """
+    tickers, dates, panel = date_panel(bars_by_ticker)
+    opens, lows, closes, volumes = (panel[field] for field in ("open", "low", "close", "volume"))
+    if not tickers:
+        return pd.DataFrame(columns=TRADE_COLUMNS)
+
+    if liquidity_filter is None:
+        import main  # deferred, main configures logging when imported
+        liquidity_filter = main.liquidity_filter(dollar_size_limit)
+
+    candidates = ind.breakout_signals(closes, volumes) & screener.candidate_signals(closes, volumes, window)
+    failures = ind.failure_signals(closes)
+    turning_down = ind.sma_turning_down(closes)
+    # Only candidates need the liquidity filter, each on the window live would have fetched
+    liquid = np.zeros_like(candidates)
+    dollar_volume = closes * volumes
+    for day in np.flatnonzero(candidates.any(axis=1)):
+        columns = np.flatnonzero(candidates[day])
+        liquid[day, columns], _ = liquidity_filter.passes(dollar_volume[max(0, day - window + 1):day + 1, columns])
+    entries = candidates & liquid
+
+    holding = np.zeros(len(tickers), dtype=bool)
+    entry_day = np.zeros(len(tickers), dtype=int)
+    entry_price = np.zeros(len(tickers))
+    stop_price = np.zeros(len(tickers))
+    trades = []
+
+    def close_out(mask, day, prices, reasons):
+        for column in np.flatnonzero(mask):
+            trades.append((column, entry_day[column], entry_price[column], stop_price[column],
+                           day, prices[column], reasons[column]))
+        holding[mask] = False
+
+    for day in range(len(dates)):
+        with np.errstate(invalid="ignore"):
+            stopped = holding & (lows[day] <= stop_price)
+        close_out(stopped, day, np.minimum(opens[day], stop_price), np.full(len(tickers), "stop"))
+
+        failed = holding & failures[day]
+        close_out(failed, day, closes[day], np.where(turning_down[day], "stage4", "stage1"))
+
+        opened = ~holding & entries[day]
+        if opened.any():
+            holding |= opened
+            entry_day[opened] = day
+            entry_price[opened] = closes[day, opened]
+            stop_pct = np.array([stop_pct_from_price(price) for price in entry_price[opened]])
+            stop_price[opened] = np.round(entry_price[opened] * (1 - stop_pct), 4)
+
+    last = len(dates) - 1
+    close_out(holding.copy(), last, closes[last], np.full(len(tickers), "open"))
+
+    rows = []
+    for column, opened_on, entry, stop, closed_on, price, reason in trades:
+        shares = int(float(trade_amount) / entry)
+        rows.append((tickers[column], ind.format_date(dates[opened_on]), float(entry), float(stop),
+                     ind.format_date(dates[closed_on]), float(price), str(reason), shares,
+                     int(closed_on - opened_on), (price / entry - 1) * 100, shares * (price - entry)))
+    return pd.DataFrame(rows, columns=TRADE_COLUMNS)
+
+
+def stats(trades):
+    """Summary P&L statistics for a trades DataFrame from run()."""
+    if trades.empty:
+        return {"trades": 0}
+    pnl = trades["pnl"]
+    wins = pnl[pnl > 0]
+    losses = pnl[pnl < 0]
+    # Drawdown of the realised equity curve, trades booked on their close date
+    equity = pnl.groupby(trades["close_date"]).sum().sort_index().cumsum()
+    drawdown = (equity.cummax().clip(lower=0) - equity).max()
+    return {
+        "trades": len(trades),
+        "win_rate": len(wins) / len(trades),
+        "average_return_pct": float(trades["return_pct"].mean()),
+        "median_return_pct": float(trades["return_pct"].median()),
+        "total_pnl": float(pnl.sum()),
+        "profit_factor": float(wins.sum() / -losses.sum()) if len(losses) else float("inf"),
+        "max_drawdown": float(drawdown),
+        "average_days_held": float(trades["days_held"].mean()),
+        "exits": trades["reason"].value_counts().to_dict(),
+    }
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 5:
+        print("Please provide a currency, barsize (1 day), dollar size limit, trade amount and optionally "
+              "a start date (YYYYMMDD) and a CSV path for the trades.")
+        sys.exit(1)
+
+    currency, bar_size, dollar_size_limit, trade_amount = sys.argv[1:5]
+    since = sys.argv[5] if len(sys.argv) > 5 else None
+
+    bars_by_ticker = bar_store.load_all(currency, bar_size, since=since)
+    print(f"Backtesting {len(bars_by_ticker)} tickers")
+    trades = run(bars_by_ticker, dollar_size_limit, trade_amount)
+    for name, value in stats(trades).items():
+        print(f"{name}: {value}")
+    if len(sys.argv) > 6:
+        trades.to_csv(sys.argv[6], index=False)
@@ -0,0 +1,202 @@
+import datetime as dt
+import json
+import os
+import threading
+from itertools import groupby
+from operator import itemgetter
+import duckdb
+import pandas as pd
+
+from bars import BarArray, as_bar_array
+from indicators import RollingIndicators
+
+# Local OHLCV cache keyed by (symbol, currency, bar_size). Daily bars are topped up
+# with only the days since the last cached bar instead of re-downloading the window.
+
+BAR_STORE_PATH = os.getenv("BAR_STORE_PATH", "cache/bars.duckdb")
+
+_DURATION_DAYS = {"S": 1 / 86400, "D": 1, "W": 7, "M": 31, "Y": 366}
+
+_connection = None
+_lock = threading.Lock()
+
+
+def connect():
+    global _connection
+    if _connection is None:
+        os.makedirs(os.path.dirname(BAR_STORE_PATH) or ".", exist_ok=True)
+        _connection = duckdb.connect(BAR_STORE_PATH)
+        _connection.execute('''
+            CREATE TABLE IF NOT EXISTS bars (
+                symbol VARCHAR,
+                currency VARCHAR,
+                bar_size VARCHAR,
+                date VARCHAR,
+                open DOUBLE,
+                high DOUBLE,
+                low DOUBLE,
+                close DOUBLE,
+                volume DOUBLE,
+                PRIMARY KEY (symbol, currency, bar_size, date)
+            )
+        ''')
+        # Earliest date a full window download covered, so a newly listed stock with
+        # little history isn't mistaken for a gap and re-downloaded every run
+        _connection.execute('''
+            CREATE TABLE IF NOT EXISTS coverage (
+                symbol VARCHAR,
+                currency VARCHAR,
+                bar_size VARCHAR,
+                covered_from VARCHAR,
+                PRIMARY KEY (symbol, currency, bar_size)
+            )
+        ''')
+        # Serialised RollingIndicators, advanced as new bars are cached
+        _connection.execute('''
+            CREATE TABLE IF NOT EXISTS indicator_state (
+                symbol VARCHAR,
+                currency VARCHAR,
+                bar_size VARCHAR,
+                state VARCHAR,
+                PRIMARY KEY (symbol, currency, bar_size)
+            )
+        ''')
+    return _connection
+
+
+def is_daily(bar_size):
+    return bar_size.strip().lower() in ("1 day", "1 d")
+
+
+def duration_days(duration):
+    """Converts an IB duration string such as "120 D" or "1 Y" to calendar days, None if unparseable."""
+    try:
+        amount, unit = duration.split()
+        return int(int(amount) * _DURATION_DAYS[unit.upper()]) or 1
+    except (ValueError, KeyError):
+        return None
+
+
+def plan_fetch(symbol, currency, duration, bar_size, today=None):
+    """
+    Decides how much history to request for a ticker.
+
+    Returns:
+        (fetch_duration, window_start): the IB duration to request and the first
+        date (YYYYMMDD) of the requested window. window_start is None when the bar
+        size or duration isn't cached, in which case fetch_duration is the full duration.
+    """
+    days = duration_days(duration)
+    if not is_daily(bar_size) or days is None:
+        return duration, None
+
+    today = today or dt.date.today()
+    window_start = (today - dt.timedelta(days=days)).strftime('%Y%m%d')
+
+    with _lock:
+        row = connect().execute('''
+            SELECT c.covered_from, max(b.date)
+            FROM coverage c LEFT JOIN bars b USING (symbol, currency, bar_size)
+            WHERE c.symbol = ? AND c.currency = ? AND c.bar_size = ?
+            GROUP BY c.covered_from
+        ''', [symbol, currency, bar_size]).fetchone()
+
+    if row is None or row[1] is None or row[0] > window_start:
+        return duration, window_start
+
+    # Re-request the last cached day too, it may have been a partial bar
+    last_date = dt.datetime.strptime(row[1][:8], '%Y%m%d').date()
+    return f"{(today - last_date).days + 1} D", window_start
+
+
+def save(symbol, currency, bar_size, bars, covered_from=None):
+    """Upserts bars, and records covered_from if they are a full window download."""
+    incoming = pd.DataFrame(as_bar_array(bars).array)
+    incoming.insert(0, "bar_size", bar_size)
+    incoming.insert(0, "currency", currency)
+    incoming.insert(0, "symbol", symbol)
+    with _lock:
+        conn = connect()
+        if len(incoming):
+            # One set-based insert, executemany costs a statement per bar
+            conn.register("incoming", incoming)
+            conn.execute("INSERT OR REPLACE INTO bars SELECT * FROM incoming")
+            conn.unregister("incoming")
+        if covered_from is not None:
+            conn.execute("INSERT OR REPLACE INTO coverage VALUES (?, ?, ?, ?)", [symbol, currency, bar_size, covered_from])
+
+
+def load(symbol, currency, bar_size, since=None):
+    """Returns the cached bars for a ticker as a BarArray in date order, optionally from `since` (YYYYMMDD) on."""
+    with _lock:
+        rows = connect().execute('''
+            SELECT date, open, high, low, close, volume
+            FROM bars
+            WHERE symbol = ? AND currency = ? AND bar_size = ? AND date >= ?
+            ORDER BY date
+        ''', [symbol, currency, bar_size, since or ""]).fetchall()
+    return BarArray.from_records(rows)
+
+
+def load_all(currency, bar_size, since=None):
+    """Returns every cached ticker for a currency and bar size as {symbol: BarArray}, in one query."""
+    with _lock:
+        rows = connect().execute('''
+            SELECT symbol, date, open, high, low, close, volume
+            FROM bars
+            WHERE currency = ? AND bar_size = ? AND date >= ?
+            ORDER BY symbol, date
+        ''', [currency, bar_size, since or ""]).fetchall()
+    return {symbol: BarArray.from_records([row[1:] for row in group])
+            for symbol, group in groupby(rows, key=itemgetter(0))}
+
+
+def load_state(symbol, currency, bar_size):
+    """Returns the stored RollingIndicators for a ticker, or None if there is none yet."""
+    with _lock:
+        row = connect().execute('''
+            SELECT state FROM indicator_state WHERE symbol = ? AND currency = ? AND bar_size = ?
+        ''', [symbol, currency, bar_size]).fetchone()
+    return RollingIndicators.from_dict(json.loads(row[0])) if row else None
+
+
+def save_state(symbol, currency, bar_size, indicators):
+    with _lock:
+        connect().execute("INSERT OR REPLACE INTO indicator_state VALUES (?, ?, ?, ?)",
+                          [symbol, currency, bar_size, json.dumps(indicators.to_dict())])
+
+
+def update_state(symbol, currency, bar_size, bars):
+    """
+    Advances a ticker's stored indicators with the bars newer than it has seen. The
+    latest bar is left out since it may still be forming, callers apply it to a copy.
+    """
+    indicators = load_state(symbol, currency, bar_size) or RollingIndicators()
+    if indicators.update_bars(bars[:-1]):
+        save_state(symbol, currency, bar_size, indicators)
+    return indicators
+
+
+def merge_store(path):
+    """
+    Copies every bar, coverage row and indicator state from another bar store file into
+    this one, replacing rows with the same key. Used to fold sharded scans' stores back
+    into the default store that the other readers use.
+    """
+    with _lock:
+        conn = connect()
+        conn.execute(f"ATTACH '{path.replace(chr(39), chr(39) * 2)}' AS merged (READ_ONLY)")
+        try:
+            for table in ("bars", "coverage", "indicator_state"):
+                conn.execute(f"INSERT OR REPLACE INTO {table} SELECT * FROM merged.{table}")
+        finally:
+            conn.execute("DETACH merged")
+
+
+def close():
+    """Closes the connection, releasing the file for other processes."""
+    global _connection
+    with _lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
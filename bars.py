@@ -0,0 +1,127 @@
+from collections import namedtuple
+
+import numpy as np
+
+# Columnar bar container. Bars stream into one NumPy structured array instead of a
+# list of BarData objects, and indicator/liquidity code works on the column views.
+
+Bar = namedtuple("Bar", ["date", "open", "high", "low", "close", "volume"])
+
+# Wide enough for intraday IB dates such as "20250426 10:00:00 Australia/Sydney"
+BAR_DTYPE = np.dtype([
+    ("date", "U40"),
+    ("open", "f8"),
+    ("high", "f8"),
+    ("low", "f8"),
+    ("close", "f8"),
+    ("volume", "f8"),
+])
+
+
+class BarArray:
+    """
+    Growable bar buffer backed by a structured array. Indexing returns a Bar, so
+    data[-1].close keeps working, while .closes, .volumes etc. are zero-copy column views.
+    """
+
+    def __init__(self, capacity=128):
+        self._data = np.empty(capacity, dtype=BAR_DTYPE)
+        self._size = 0
+
+    @classmethod
+    def from_records(cls, records):
+        """Builds a BarArray from (date, open, high, low, close, volume) tuples."""
+        records = list(records)
+        bars = cls(max(len(records), 1))
+        if records:
+            bars._data[:len(records)] = np.array(records, dtype=BAR_DTYPE)
+            bars._size = len(records)
+        return bars
+
+    @classmethod
+    def from_bars(cls, data):
+        """Builds a BarArray from objects with date/open/high/low/close/volume attributes."""
+        return cls.from_records((str(bar.date), bar.open, bar.high, bar.low, bar.close, float(bar.volume)) for bar in data)
+
+    def append(self, bar):
+        if self._size == len(self._data):
+            grown = np.empty(len(self._data) * 2, dtype=BAR_DTYPE)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+        # IB sends volume as a Decimal in recent API versions
+        self._data[self._size] = (str(bar.date), bar.open, bar.high, bar.low, bar.close, float(bar.volume))
+        self._size += 1
+
+    def extend(self, data):
+        for bar in data:
+            self.append(bar)
+
+    @property
+    def array(self):
+        return self._data[:self._size]
+
+    @property
+    def dates(self):
+        return self.array["date"]
+
+    @property
+    def opens(self):
+        return self.array["open"]
+
+    @property
+    def highs(self):
+        return self.array["high"]
+
+    @property
+    def lows(self):
+        return self.array["low"]
+
+    @property
+    def closes(self):
+        return self.array["close"]
+
+    @property
+    def volumes(self):
+        return self.array["volume"]
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return BarArray.from_records(self.array[index].tolist())
+        return Bar(*self.array[index].tolist())
+
+    def __iter__(self):
+        return (Bar(*row) for row in self.array.tolist())
+
+    def __repr__(self):
+        if not self._size:
+            return "BarArray([])"
+        return f"BarArray({self._size} bars, {self.dates[0]} to {self.dates[-1]}, last close {self.closes[-1]})"
+
+
+def as_bar_array(data):
+    """Returns data as a BarArray, converting lists of bar objects."""
+    return data if isinstance(data, BarArray) else BarArray.from_bars(data)
+
+
+def build_panel(bars_by_ticker):
+    """
+    Stacks every ticker's bars into days x tickers arrays aligned on the latest bar,
+    so a trading halt shortens a ticker's history instead of punching holes in it.
+
+    Returns:
+        (tickers, closes, volumes): closes and volumes are NaN before a ticker's first bar.
+    """
+    tickers = list(bars_by_ticker)
+    length = max((len(bars) for bars in bars_by_ticker.values()), default=0)
+    closes = np.full((length, len(tickers)), np.nan)
+    volumes = np.full((length, len(tickers)), np.nan)
+
+    for column, ticker in enumerate(tickers):
+        bars = as_bar_array(bars_by_ticker[ticker])
+        closes[length - len(bars):, column] = bars.closes
+        volumes[length - len(bars):, column] = bars.volumes
+
+    return tickers, closes, volumes
@@ -0,0 +1,301 @@
+import asyncio
+import datetime as dt
+import logging
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+import numpy as np
+import pandas as pd
+
+import backends
+import bar_store
+import insight_cache
+import main
+import metrics
+import pacing
+import rules_engine
+import run_cache
+import track_recommedations as tr
+import universe
+from bars import Bar
+from trade_data import IBKR, MAX_HISTORICAL_IN_FLIGHT
+
+# Scan throughput benchmark that needs neither the IB gateway nor LLM keys: a fake
+# gateway answers historical requests with synthetic bars, a fake model answers with
+# the rules engine after a delay, and tracked_stocks lives in a temporary SQLite file.
+# process_data and check_db_stocks_still_stage_2 run unchanged on top of them.
+
+logger = logging.getLogger('main')
+
+SIZES = (100, 1000, 5000)
+CURRENCY = "AUD"
+DURATION = "120 D"
+BAR_SIZE = "1 day"
+DOLLAR_SIZE_LIMIT = 500000
+TRADE_AMOUNT = 5000
+HISTORY_DAYS = 400  # business days of synthetic history per ticker
+PACING_VIOLATION = 162  # IB's historical data pacing error code
+# SDKs only some modes need, which importing main should not load
+HEAVY_MODULES = ("google.ai.generativelanguage", "google.api_core", "ollama", "yfinance", "psycopg2", "ib_insync", "requests")
+
+
+def synthetic_bars(symbol, days=HISTORY_DAYS, end=None):
+    """
+    A deterministic random walk per symbol with occasional volume spikes, so some
+    tickers break out, some fail and some are too illiquid to pass the filter.
+    """
+    rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+    dates = pd.bdate_range(end=end or dt.date.today(), periods=days).strftime("%Y%m%d")
+    closes = np.maximum(rng.uniform(0.5, 50) * np.exp(np.cumsum(rng.normal(0.0005, 0.02, days))), 0.01)
+    volumes = rng.uniform(1e4, 1e6, days) * rng.choice([0.1, 1, 10]) * np.where(rng.random(days) < 0.05, 3, 1)
+    opens = closes * rng.uniform(0.98, 1.02, days)
+    highs = np.maximum(opens, closes) * rng.uniform(1, 1.02, days)
+    lows = np.minimum(opens, closes) * rng.uniform(0.98, 1, days)
+    return [Bar(*row) for row in zip(dates, opens, highs, lows, closes, np.round(volumes))]
+
+
+class FakeGateway(IBKR):
+    """
+    IBKR whose requests are answered locally instead of by the gateway. Each request
+    gets its bars `latency` seconds later on a callback thread, as with a real socket,
+    and a `pacing_error_rate` fraction fail with a pacing violation instead.
+    """
+
+    def __init__(self, latency=0.05, pacing_error_rate=0.0, seed=0):
+        super().__init__()
+        self.latency = latency
+        self.pacing_error_rate = pacing_error_rate
+        self.rng = np.random.default_rng(seed)
+        self.rng_lock = threading.Lock()
+        self.served = 0
+        self.pacing_errors = 0
+        self.callbacks = ThreadPoolExecutor(max_workers=MAX_HISTORICAL_IN_FLIGHT)
+        self.nextValidId(1)
+
+    def reqHistoricalData(self, reqId, contract, endDateTime, durationStr, barSizeSetting, whatToShow,
+                          useRTH, formatDate, keepUpToDate, chartOptions):
+        self.callbacks.submit(self._serve, reqId, contract.symbol, durationStr)
+
+    def cancelHistoricalData(self, reqId):
+        pass
+
+    def _serve(self, reqId, symbol, duration):
+        time.sleep(self.latency)
+        with self.rng_lock:
+            violation = self.rng.random() < self.pacing_error_rate
+        if violation:
+            self.pacing_errors += 1
+            self.error(reqId, PACING_VIOLATION, "Historical Market Data Service error message:Historical data request pacing violation")
+            return
+
+        # Calendar days to trading days, roughly
+        days = max(1, (bar_store.duration_days(duration) or HISTORY_DAYS) * 5 // 7)
+        bars = synthetic_bars(symbol)[-days:]
+        for bar in bars:
+            self.historicalData(reqId, bar)
+        self.served += 1
+        self.historicalDataEnd(reqId, bars[0].date if bars else "", bars[-1].date if bars else "")
+
+    def close(self):
+        self.callbacks.shutdown(wait=False)
+
+
+class FakeLLM(backends.Backend):
+    """Stands in for a model backend: answers with the rules engine after `latency` seconds."""
+    name = "fake_llm"
+
+    def __init__(self, latency=0.5, concurrency=6):
+        self.latency = latency
+        self.max_concurrency = concurrency
+        self.calls = 0
+
+    async def classify(self, ticker, data, crossover_date=None, crossover_price=None):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return backends.Verdict(rules_engine.generate_insight(ticker, logger, data, crossover_date, crossover_price), 1.0)
+
+
+def isolate(directory):
+    """Points the bar store, insight cache, listing snapshots and tracked_stocks at a fresh directory."""
+    bar_store.BAR_STORE_PATH = os.path.join(directory, "bars.duckdb")
+    bar_store._connection = None
+    insight_cache.INSIGHT_CACHE_PATH = os.path.join(directory, "insights.sqlite")
+    insight_cache._connection = None
+    universe.UNIVERSE_DIR = os.path.join(directory, "universe")
+
+    tr.use_pool(tr.SingleConnectionPool(sqlite3.connect(os.path.join(directory, "tracked.sqlite"), check_same_thread=False)))
+    tr.initialize_db()
+
+
+def write_listing(count):
+    """A fresh ASX listing snapshot of `count` made-up codes, so fetch_asx_stocks never hits the network."""
+    os.makedirs(universe.UNIVERSE_DIR, exist_ok=True)
+    snapshot_path, meta_path = universe._paths("asx")
+    pd.DataFrame({
+        "symbol": [f"B{i:04d}" for i in range(count)],
+        "name": "Benchmark", "sector": "Benchmark", "industry": "Benchmark", "market_cap": float("nan"),
+    }).to_csv(snapshot_path, index=False)
+    universe._write_meta("asx", {"fetched_at": time.time()})
+
+
+class Timer:
+    """Collects call latencies for a function, so check_db's steps can be reported like pipeline stages."""
+
+    def __init__(self, func):
+        self.func = func
+        self.latencies = []
+
+    def __call__(self, *args, **kwargs):
+        started = time.monotonic()
+        try:
+            return self.func(*args, **kwargs)
+        finally:
+            self.latencies.append(time.monotonic() - started)
+
+
+def describe(name, latencies):
+    if not latencies:
+        return f"    {name}: no calls"
+    ms = np.asarray(latencies) * 1000
+    return (f"    {name}: {len(ms)} calls, mean {ms.mean():.1f}ms, p50 {np.percentile(ms, 50):.1f}ms, "
+            f"p95 {np.percentile(ms, 95):.1f}ms")
+
+
+def bench_size(count, gateway_latency, pacing_error_rate, llm_latency, cascade=False):
+    """
+    Runs process_data, then check_db_stocks_still_stage_2 with every ticker open, and returns
+    the report lines. With cascade, the rules answer first and only unsure cases reach the model.
+    """
+    report = [f"{count} tickers{', rules then model' if cascade else ''}"]
+    metrics.reset()
+    with tempfile.TemporaryDirectory() as directory:
+        isolate(directory)
+        write_listing(count)
+        app = FakeGateway(gateway_latency, pacing_error_rate)
+        llm = FakeLLM(llm_latency)
+        backend = backends.CascadeBackend([backends.RulesBackend(), llm]) if cascade else llm
+        tracker = tr.TrackingBatch()
+
+        started = time.monotonic()
+        stages = main.process_data(app, "fetch_asx_stocks", CURRENCY, DURATION, BAR_SIZE, backend,
+                                   DOLLAR_SIZE_LIMIT, TRADE_AMOUNT, run_cache.RunCache(), tracker)
+        tracker.flush()
+        scan_seconds = time.monotonic() - started
+
+        report.append(f"  process_data: {scan_seconds:.1f}s, {count / scan_seconds * 60:,.0f} tickers/min, "
+              f"{app.served} served, {app.pacing_errors} pacing errors, {llm.calls} model calls")
+        for stage in stages or []:
+            report.append(describe(stage.name, stage.latencies))
+
+        # Every ticker becomes an open position, so the check covers `count` tickers too
+        positions = tr.TrackingBatch()
+        crossover = (dt.date.today() - dt.timedelta(days=60)).isoformat()
+        for i in range(count):
+            positions.track_stock(f"B{i:04d}", "STAGE2", 1.0, crossover, 1.0)
+        positions.flush()
+        open_count = len(tr.get_open_positions())
+
+        fetch, insight = Timer(main.get_ticker_data), Timer(main.get_insight)
+        main.get_ticker_data, main.get_insight = fetch, insight
+        llm.calls = 0
+        try:
+            started = time.monotonic()
+            main.check_db_stocks_still_stage_2(app, CURRENCY, DURATION, BAR_SIZE, backend, DOLLAR_SIZE_LIMIT,
+                                               run_cache.RunCache(), tr.TrackingBatch())
+            check_seconds = time.monotonic() - started
+        finally:
+            main.get_ticker_data, main.get_insight = fetch.func, insight.func
+
+        report.append(f"  check_db_stocks_still_stage_2: {check_seconds:.1f}s, {open_count / check_seconds * 60:,.0f} positions/min, "
+              f"{llm.calls} model calls")
+        report.append(describe("fetch", fetch.latencies))
+        report.append(describe("insight", insight.latencies))
+        report.append(metrics.summary())
+
+        app.close()
+        for module in (bar_store, insight_cache):
+            if module._connection is not None:
+                module._connection.close()
+                module._connection = None
+    return report
+
+
+def bench_startup(repeats=5, module="main"):
+    """
+    Times `import module` in fresh interpreters, which every cron-launched run pays before
+    its first request, and returns report lines with the slowest direct imports and any
+    HEAVY_MODULES that were loaded.
+    """
+    code = (f"import sys, time; started = time.perf_counter(); import {module}; "
+            f"print(time.perf_counter() - started, *[m for m in {HEAVY_MODULES!r} if m in sys.modules])")
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    process_seconds, import_seconds = [], []
+    # Run elsewhere so main's log handler doesn't touch the real log
+    with tempfile.TemporaryDirectory() as directory:
+        for _ in range(repeats):
+            started = time.monotonic()
+            output = subprocess.run([sys.executable, "-c", code], cwd=directory, env=env,
+                                    capture_output=True, text=True, check=True).stdout.split()
+            process_seconds.append(time.monotonic() - started)
+            import_seconds.append(float(output[0]))
+        loaded = output[1:]
+        profile = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=directory, env=env,
+                                 capture_output=True, text=True, check=True).stderr
+
+    report = [f"Startup, {repeats} runs of `import {module}`",
+              describe("process", process_seconds), describe(f"import {module}", import_seconds),
+              f"    heavy SDKs loaded: {', '.join(loaded) or 'none'}",
+              "    slowest direct imports:"]
+    # "import time: self | cumulative | name", with a module's imports listed just before it
+    # and indented two more spaces
+    direct = []
+    for line in profile.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not name.startswith("  "):
+            if name.strip() == module:
+                break
+            direct = []
+        elif not name.startswith("    "):
+            direct.append((int(cumulative), name.strip()))
+    for cumulative, name in sorted(direct, reverse=True)[:8]:
+        report.append(f"      {name}: {cumulative / 1000:.1f}ms")
+    return report
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1 and sys.argv[1] == "startup":
+        print("\n".join(bench_startup(int(sys.argv[2]) if len(sys.argv) > 2 else 5)))
+        sys.exit(0)
+
+    sizes = [int(size) for size in sys.argv[1].split(",")] if len(sys.argv) > 1 else SIZES
+    gateway_latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    pacing_error_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.01
+    llm_latency = float(sys.argv[4]) if len(sys.argv) > 4 else 0.5
+    # Measure the pipeline itself, not IB's 60 requests a minute, unless "pacing" is given.
+    # "cascade" puts the rules in front of the model, as with a rules,gemini backend.
+    keep_pacing = "pacing" in sys.argv[5:]
+    cascade = "cascade" in sys.argv[5:]
+
+    if not keep_pacing:
+        pacing.configure(pacing.IB_HISTORICAL, 1_000_000, 1)
+    # Per-ticker output would swamp the report, so the runs print to /dev/null and only errors are logged
+    logger.setLevel(logging.ERROR)
+    logging.getLogger("ibapi").setLevel(logging.CRITICAL)
+
+    print(f"Gateway latency {gateway_latency}s, pacing error rate {pacing_error_rate}, model latency {llm_latency}s, "
+          f"IB pacing {'on' if keep_pacing else 'off'}, cascade {backends.CONFIDENCE_THRESHOLD if cascade else 'off'}")
+    for size in sizes:
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            report = bench_size(size, gateway_latency, pacing_error_rate, llm_latency, cascade)
+        print("\n".join(report), flush=True)
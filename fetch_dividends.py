@@ -1,30 +1,174 @@
 import logging
+import os
+import sqlite3
+import threading
 import time
-import yfinance as yf
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
 import pandas as pd
+
+import pacing
+
 logger = logging.getLogger('main')  # This should match the logger name from main.py
 
-def generate_dividend_for_ticker(ticker, app, currency):
-    try:
-        logger.info(f"Processing ticker: {ticker}")
-        time.sleep(1)
+# Dividend events are kept locally, so later runs only ask Yahoo for ex-dates after
+# the last one stored, and yearly totals come from one grouped query over all tickers.
+
+DIVIDEND_STORE_PATH = os.getenv("DIVIDEND_STORE_PATH", "cache/dividends.sqlite")
+DIVIDEND_WORKERS = 8  # concurrent Yahoo requests, all drawing on the shared YFINANCE budget
+MAX_AGE = 24 * 60 * 60  # seconds before a ticker is checked for new ex-dates again
+
+_connection = None
+_lock = threading.Lock()
+
 
+def connect():
+    global _connection
+    if _connection is None:
+        os.makedirs(os.path.dirname(DIVIDEND_STORE_PATH) or ".", exist_ok=True)
+        _connection = sqlite3.connect(DIVIDEND_STORE_PATH, check_same_thread=False)
+        _connection.execute('''
+            CREATE TABLE IF NOT EXISTS dividends (
+                ticker TEXT,
+                ex_date TEXT,
+                amount REAL,
+                PRIMARY KEY (ticker, ex_date)
+            )
+        ''')
+        # When each ticker was last asked for, including tickers that never paid
+        _connection.execute('''
+            CREATE TABLE IF NOT EXISTS dividend_checks (
+                ticker TEXT PRIMARY KEY,
+                checked REAL
+            )
+        ''')
+        _connection.commit()
+    return _connection
+
+
+def last_ex_date(ticker):
+    with _lock:
+        row = connect().execute("SELECT max(ex_date) FROM dividends WHERE ticker = ?", (ticker,)).fetchone()
+    return row[0]
+
+
+def stale(tickers, max_age=MAX_AGE):
+    """The tickers not checked within max_age seconds."""
+    with _lock:
+        checked = dict(connect().execute("SELECT ticker, checked FROM dividend_checks").fetchall())
+    now = time.time()
+    return [ticker for ticker in tickers if now - checked.get(ticker, 0) >= max_age]
+
+
+def download(ticker, since=None):
+    """Dividend events from Yahoo as (YYYY-MM-DD, amount) pairs, only those after `since` if given."""
+    import yfinance as yf  # deferred, it takes half a second to import and the store often has everything
+    if since is None:
         dividends = yf.Ticker(ticker).dividends
-        time.sleep(1)
-        # Ensure the index is a datetime object
-        dividends = dividends.to_frame()
-        dividends.index = pd.to_datetime(dividends.index)
+    else:
+        start = (datetime.strptime(since, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+        if start > datetime.now().strftime("%Y-%m-%d"):
+            return []
+        history = yf.Ticker(ticker).history(start=start, actions=True)
+        dividends = history["Dividends"] if "Dividends" in history else pd.Series(dtype=float)
+    dividends = dividends[dividends > 0]
+    return [(date.strftime("%Y-%m-%d"), float(amount)) for date, amount in dividends.items()]
 
-        # Add a column for the year
-        dividends['Year'] = dividends.index.year
 
-        # Group by the year and sum the dividends for each year
-        dividends_summary = dividends.groupby('Year')['Dividends'].sum()
+def transient_errors():
+    """
+    Yahoo rate limits and network failures, the only errors worth retrying. A bad symbol
+    or an unparseable response fails the same way every time.
+    """
+    import requests
+    from yfinance.exceptions import YFRateLimitError
+
+    errors = [YFRateLimitError, requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError]
+    try:
+        # yfinance 0.2.60 and later fetch through curl_cffi
+        from curl_cffi.requests import exceptions as curl_exceptions
+        errors += [curl_exceptions.ConnectionError, curl_exceptions.Timeout]
+    except ImportError:
+        pass
+    return tuple(errors)
 
-        # Optionally, you can also count the number of dividends per year
-        dividends_count = dividends.groupby('Year')['Dividends'].count()
-        return dividends_summary, dividends_count
+
+def save(ticker, events):
+    with _lock:
+        conn = connect()
+        conn.executemany("INSERT OR REPLACE INTO dividends VALUES (?, ?, ?)", [(ticker, *event) for event in events])
+        conn.execute("INSERT OR REPLACE INTO dividend_checks VALUES (?, ?)", (ticker, time.time()))
+        conn.commit()
+
+
+def refresh_ticker(ticker):
+    """Fetches and stores the ticker's ex-dates newer than the store has. Returns how many were new."""
+    since = last_ex_date(ticker)
+
+    def fetch():
+        pacing.acquire(pacing.YFINANCE)
+        return download(ticker, since)
+
+    events = pacing.retry(fetch, pacing.YFINANCE, retry_on=transient_errors())
+    save(ticker, events)
+    return len(events)
+
+
+def refresh(tickers, max_workers=DIVIDEND_WORKERS, max_age=MAX_AGE):
+    """
+    Brings the store up to date for every ticker not checked within max_age, fetching
+    concurrently under the shared YFINANCE rate limit.
+
+    Returns:
+        dict: ticker -> number of new ex-dates, for the tickers that were fetched.
+    """
+    todo = stale(tickers, max_age)
+    logger.info(f"Fetching dividends for {len(todo)} of {len(tickers)} tickers")
+    new = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(refresh_ticker, ticker): ticker for ticker in todo}
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                new[ticker] = future.result()
+            except Exception as e:
+                logger.error(f"Failed to fetch data for {ticker}: {str(e)}")
+    return new
+
+
+def yearly_summary(tickers=None):
+    """
+    Dividend totals and counts per ticker and year from the store, in one grouped query.
+
+    Returns:
+        DataFrame indexed by (ticker, year) with 'Dividends' (sum) and 'Count' columns.
+    """
+    query = '''
+        SELECT ticker, CAST(substr(ex_date, 1, 4) AS INTEGER) AS year, sum(amount), count(*)
+        FROM dividends
+        {where}
+        GROUP BY ticker, year
+        ORDER BY ticker, year
+    '''
+    where, params = "", []
+    if tickers is not None:
+        params = list(tickers)
+        where = f"WHERE ticker IN ({','.join('?' * len(params))})" if params else "WHERE 0"
+    with _lock:
+        rows = connect().execute(query.format(where=where), params).fetchall()
+    return pd.DataFrame(rows, columns=["ticker", "Year", "Dividends", "Count"]).set_index(["ticker", "Year"])
+
+
+def generate_dividend_for_ticker(ticker, app, currency):
+    """Yearly dividend sums and counts for one ticker as two Series indexed by year, (None, None) on failure."""
+    try:
+        logger.info(f"Processing ticker: {ticker}")
+        if stale([ticker]):
+            refresh_ticker(ticker)
+        summary = yearly_summary([ticker]).reset_index(level="ticker", drop=True)
+        return summary["Dividends"], summary["Count"]
 
     except Exception as e:
         logger.error(f"Failed to fetch data for {ticker}: {str(e)}")
-        return None, None
\ No newline at end of file
+        return None, None
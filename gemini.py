@@ -1,11 +1,13 @@
 from dotenv import load_dotenv
 load_dotenv()
 import os
-import google.generativeai as genai
-import itertools
+import threading
 import time
-import pandas as pd
-from io import StringIO
+from collections import deque
+
+import metrics
+import pacing
+import prompts
 
 
 API_KEYS = [
@@ -20,45 +22,125 @@ API_KEYS = [
 # Remove None values in case some keys are missing
 API_KEYS = [key for key in API_KEYS if key]
 
-if not API_KEYS:
-    raise ValueError("No valid API keys found. Please check your environment variables.")
-
-# Create a cycle iterator for API keys
-api_key_cycle = itertools.cycle(API_KEYS)
-
-# Track the number of requests per API key
-api_usage = {key: 0 for key in API_KEYS}
 REQUEST_LIMIT = 15  # Max requests per API key per minute
 TIME_WINDOW = 60  # Time window in seconds (1 minute)
+MODEL_NAME = 'gemini-2.0-flash'
+WITH_INDICATORS = True  # send precomputed SMA5/SMA30/volume ratio columns with the bars
+
+# One request in flight per key, so throughput scales with the number of keys
+MAX_CONCURRENCY = max(1, len(API_KEYS))
+
+# The Google SDK takes a third of a second to import, so it and the client pool are only
+# loaded by the first request, not by importing this module
+_client_pool = None
+_pool_lock = threading.Lock()
 
-def get_next_api_key():
-    """Returns the next API key in the cycle."""
-    return next(api_key_cycle)
 
-def configure_gemini():
-    #"""Configures the Gemini API with the next available API key."""
-    next_key = get_next_api_key()
-    genai.configure(api_key=next_key)
-    return next_key
+def transient_errors():
+    """Rate limits and server-side failures, retried with backoff on whichever key is free next."""
+    from google.api_core import exceptions as api_exceptions
 
-# Set initial API key
-current_api_key = configure_gemini()
-# Configure the API key
-genai.configure(api_key=current_api_key)
+    return (
+        api_exceptions.ResourceExhausted,
+        api_exceptions.ServiceUnavailable,
+        api_exceptions.DeadlineExceeded,
+        api_exceptions.InternalServerError,
+    )
 
 
-def enforce_rate_limit():
-    """Ensures requests do not exceed the allowed limit per API key per minute."""
-    global current_api_key
+def check_keys():
+    if not API_KEYS:
+        raise ValueError("No valid API keys found. Please check your environment variables.")
 
-    if api_usage[current_api_key] >= REQUEST_LIMIT:
-        print(f"API key {current_api_key} reached limit. Switching keys...")
-        # current_api_key = configure_gemini()
-        # api_usage[current_api_key] = 0  # Reset usage for the new key
-        print(f"Switched to API key: {current_api_key}")
 
-    api_usage[current_api_key] += 1
-    print(f"Using API key {current_api_key}, Request Count: {api_usage[current_api_key]}")
+class GeminiClientPool:
+    """
+    Owns a client per API key and tracks each key's requests over a sliding
+    TIME_WINDOW, handing out the least-used key that is idle and under REQUEST_LIMIT.
+    """
+
+    def __init__(self, api_keys, request_limit=REQUEST_LIMIT, time_window=TIME_WINDOW):
+        self.api_keys = list(api_keys)
+        self.labels = {key: f"key{i}" for i, key in enumerate(self.api_keys, start=1)}
+        self.request_limit = request_limit
+        self.time_window = time_window
+        self.usage = {key: deque() for key in self.api_keys}  # request start times per key
+        self.in_flight = set()
+        self.clients = {}
+        self.condition = threading.Condition()
+
+    def _prune(self, key, now):
+        window = self.usage[key]
+        while window and window[0] <= now - self.time_window:
+            window.popleft()
+
+    def acquire(self):
+        """
+        Blocks until a key is idle and under its limit, then reserves it. Returns the key.
+        The time spent blocked is recorded as pacing_wait_seconds{resource="gemini"}.
+        """
+        started = time.monotonic()
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                idle = [key for key in self.api_keys if key not in self.in_flight]
+                for key in idle:
+                    self._prune(key, now)
+
+                ready = [key for key in idle if len(self.usage[key]) < self.request_limit]
+                if ready:
+                    key = min(ready, key=lambda k: len(self.usage[k]))
+                    self.usage[key].append(now)
+                    self.in_flight.add(key)
+                    metrics.observe("pacing_wait_seconds", now - started, resource=pacing.GEMINI)
+                    return key
+
+                # Wake on a release, or when the oldest request of an idle key leaves its window
+                expiries = [self.usage[key][0] + self.time_window - now for key in idle]
+                if expiries:
+                    print(f"All idle API keys at {self.request_limit} requests per {self.time_window}s, waiting {min(expiries):.1f}s")
+                self.condition.wait(min(expiries) if expiries else None)
+
+    def release(self, key):
+        with self.condition:
+            self.in_flight.discard(key)
+            self.condition.notify()
+
+    def client(self, key):
+        if key not in self.clients:
+            from google.ai import generativelanguage as glm
+
+            self.clients[key] = glm.GenerativeServiceClient(client_options={"api_key": key})
+        return self.clients[key]
+
+    def generate(self, prompt, model=MODEL_NAME):
+        """Sends prompt to the model on the least-loaded key and returns the response text."""
+        from google.ai import generativelanguage as glm
+
+        key = self.acquire()
+        try:
+            response = self.client(key).generate_content(glm.GenerateContentRequest(
+                model=f"models/{model}",
+                contents=[glm.Content(role="user", parts=[glm.Part(text=prompt)])],
+            ))
+            return "".join(part.text for part in response.candidates[0].content.parts)
+        except transient_errors():
+            raise
+        except Exception as e:
+            raise RuntimeError(f"{e} (API key: {self.labels[key]})") from e
+        finally:
+            self.release(key)
+
+
+def client_pool():
+    """The shared pool, created on first use."""
+    global _client_pool
+    with _pool_lock:
+        if _client_pool is None:
+            check_keys()
+            _client_pool = GeminiClientPool(API_KEYS)
+    return _client_pool
+
 
 def generate_insight(ticker, logger, data, crossover_date, crossover_price):
     """
@@ -76,62 +158,19 @@ def generate_insight(ticker, logger, data, crossover_date, crossover_price):
              if an error occurs.
     """
     try:
-
-        # Introduce a 10-second delay before switching to the next API key
-        time.sleep(10)
-
-        # Switch to the next API key
-        key = configure_gemini()
-        genai.configure(api_key=key)
-        model = genai.GenerativeModel('gemini-2.0-flash')
-
-        content = []
-
-
-        for row in data:
-            content.append(f"{row.date},{row.open},{row.high},{row.low},{row.close},{row.volume}\n")
-
-            # === Base rules for all stocks ===
-            base_prompt = ""
-            breakout_prompt = (
-                f"Act as a strict rules-based trading analyst. Using the provided OHLCV data, determine the first date the stock {ticker} entered Stage 2 based on the classic Stan Weinstein method.\n\n"
-                "**Stage 2 confirmation requires ALL of the following on the SAME day:**\n"
-                "1. CLOSE is ABOVE the resistance (highest CLOSE in past 6–8 weeks).\n"
-                "2. 5-day SMA is ABOVE the 30-day SMA.\n"
-                "3. Volume is at least 2× the 30-day average volume.\n\n"
-                "**Return ONLY this format. No explanation:**\n"
-                "- STAGEX on YYYY-MM-DD at $CLOSE_PRICE\n"
-            )
-            validation_prompt = (
-                f"Act as a strict rules-based trading analyst. Using the provided OHLCV data, determine if Stage 2 is still valid for {ticker}.\n\n"
-                f"Stage 2 breakout was previously confirmed on {crossover_date} at ${crossover_price:.2f}.\n"
-                "**Stage 2 is considered FAILED if either of the following occurs:**\n"
-                "- CLOSE remains below the 30-day SMA for 5 or more consecutive days.\n"
-                "- The 30-day SMA flattens or turns downward.\n"
-                "If failed, reclassify as Stage 1 or Stage 4 based on recent price action.\n\n"
-                "**Return ONLY ONE of the following (no explanation):**\n"
-                "- STAGEX on YYYY-MM-DD at $CLOSE_PRICE\n"
-            )
-
-            if crossover_date != None and crossover_price != None:
-                base_prompt += validation_prompt
-            else:
-                base_prompt += breakout_prompt
-
-        csv_header = "\n\nDate, Open, High, Low, Close, Volume\n"
-        csv_data = ', '.join(map(str, content))
-        prompt = f"{base_prompt}{csv_header}{csv_data}"
+        prompt = prompts.build_prompt(ticker, data, crossover_date, crossover_price, with_indicators=WITH_INDICATORS)
 
         logger.info(prompt)
 
-        response = model.generate_content(prompt)
+        # Any idle key under its limit will do, the pool picks the least loaded
+        response = pacing.retry(lambda: client_pool().generate(prompt), pacing.GEMINI, retry_on=transient_errors())
 
         # store this insight into a db table
-        print(f"Gemini Response: {response.text}")
-        return response.text
+        print(f"Gemini Response: {response}")
+        return response
 
     except Exception as e:
-        logger.error(f"Error: {e} (API Key: {key}). Not retrying.")
+        logger.error(f"Error generating insight for {ticker}: {e}")
         return None  # Or handle it as needed
 
 if __name__ == "__main__":
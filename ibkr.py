@@ -1,15 +1,17 @@
-from trade_data import IBKR
-from ib_insync import *
-import time
-def setup_ibkr(port=4002):
+from trade_data import IBKR, HistoricalDataError
+
+import bar_store
+import metrics
+import pacing
+from liquidity import LiquidityFilter
+
+def setup_ibkr(port=4002, client_id=0):
     ibkr = IBKR()
-    ibkr.connect("127.0.0.1", port, clientId=0)
+    ibkr.connect("127.0.0.1", port, clientId=client_id)
     return ibkr
 
-def getData(app, ticker, currency, duration, bar_size, dollar_size_limit, exchange_type):
-    time.sleep(3)  # space requests to avoid rate limits
-
-    data = (app.get_historical_data(ticker, currency, duration, bar_size, exchange_type))
+def getData(app, ticker, currency, duration, bar_size, dollar_size_limit, exchange_type, liquidity_filter=None):
+    data = fetch_bars(app, ticker, currency, duration, bar_size, exchange_type)
     # if data:
     #     close_price = data[-1][-1].close
     #     vol = data[-1][-1].volume
@@ -23,28 +25,40 @@ def getData(app, ticker, currency, duration, bar_size, dollar_size_limit, exchan
     # else:
     #     print(f"kicking out no data")
 
-    if data:
-        total_dollar_volume = 0
+    return filter_by_dollar_volume(ticker, data, dollar_size_limit, liquidity_filter)
 
-        for i in range(len(data)):
-            entry = data[i]
-            close_price = entry.close
-            vol = entry.volume
-            dollar_vol = close_price * vol
-
-            total_dollar_volume += dollar_vol
+@metrics.timed("fetch_seconds")
+def fetch_bars(app, ticker, currency, duration, bar_size, exchange_type):
+    """
+    Returns the bars for the duration window, requesting only the days newer than
+    the local bar store has for daily bars.
+    """
+    fetch_duration, window_start = bar_store.plan_fetch(ticker, currency, duration, bar_size)
+    data = pacing.retry(lambda: app.get_historical_data(ticker, currency, fetch_duration, bar_size, exchange_type),
+                        pacing.IB_HISTORICAL, retry_on=(HistoricalDataError,))
+    metrics.inc("fetched_total", result="bars" if data else "empty")
+    return merge_cached_bars(ticker, currency, duration, bar_size, data, fetch_duration, window_start)
 
-        average_dollar_volume = total_dollar_volume / len(data)
+def merge_cached_bars(ticker, currency, duration, bar_size, data, fetch_duration, window_start):
+    if window_start is None:
+        return data
 
-        if average_dollar_volume > float(dollar_size_limit):
-            print(f"Keeping stock {ticker} over {dollar_size_limit} dollar volume, average dollar amount is {average_dollar_volume}")
-            return data
-        else:
-            print(f"Kicking out stock {ticker} under {dollar_size_limit} dollar volume, average amount is {average_dollar_volume}")
+    if fetch_duration == duration:
+        # Full window download, only record coverage if it actually returned bars
+        bar_store.save(ticker, currency, bar_size, data, covered_from=window_start if data else None)
     else:
-        print(f"No data available {ticker}")
+        bar_store.save(ticker, currency, bar_size, data)
+
+    bars = bar_store.load(ticker, currency, bar_size, since=window_start)
+    # Only the new bars touch the indicator state, never the whole history
+    bar_store.update_state(ticker, currency, bar_size, bars)
+    return bars
 
-    return []
+def filter_by_dollar_volume(ticker, data, dollar_size_limit, liquidity_filter=None):
+    liquidity_filter = liquidity_filter or LiquidityFilter(dollar_size_limit)
+    result = liquidity_filter.evaluate(ticker, data)
+    print(liquidity_filter.describe(result))
+    return data if result.passed else []
 
 def stop_pct_from_price(price):
     if price < 0.2:
@@ -67,6 +81,8 @@ def place_order(app, ticker, price, action, exchange, currency, volume, logger):
     Places a limit entry order.
     action = 'BUY' or 'SELL'
     """
+    from ib_insync import LimitOrder, Stock  # deferred, only order placement needs ib_insync
+
     contract = Stock(ticker, exchange, currency)
     limit_order = LimitOrder(action, volume, price)
     app.placeOrder(contract, limit_order)
@@ -89,6 +105,8 @@ def place_stop_loss(app, contract, entry_price, action, volume, logger):
         stop_price = round(entry_price * (1 + stop_pct), 4)
         stop_action = 'BUY'
 
+    from ib_insync import StopOrder
+
     stop_order = StopOrder(stop_action, volume, stop_price)
     app.placeOrder(contract, stop_order)
     logger.info(f"Stop {stop_action} at {stop_price} placed.")
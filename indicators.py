@@ -0,0 +1,231 @@
+from collections import deque, namedtuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from bars import as_bar_array
+
+# Stan Weinstein Stage 2 rule parameters, shared by the rules engine and the screener
+SMA_SHORT = 5
+SMA_LONG = 30
+VOLUME_WINDOW = 30  # days in the average volume the breakout volume is compared against
+VOLUME_MULTIPLE = 2
+RESISTANCE_WINDOW = 30  # 6 weeks of trading days, the short end of the 6-8 week rule
+FAILURE_DAYS = 5  # consecutive closes below the long SMA that end Stage 2
+SLOPE_DAYS = 5  # lookback used to decide whether the long SMA has turned down
+
+MIN_BARS = max(SMA_LONG, VOLUME_WINDOW, RESISTANCE_WINDOW) + 1
+# Bars before both failure rules can fire: the long SMA and its SLOPE_DAYS lookback
+FAILURE_WARMUP = SMA_LONG + SLOPE_DAYS
+
+# All functions work along axis 0, so they take a single series (1-D) or a
+# days x tickers panel (2-D) alike. NaN marks days without enough history.
+
+
+def format_date(value):
+    """Converts an IB bar date ("YYYYMMDD" or "YYYYMMDD HH:MM:SS tz") to YYYY-MM-DD."""
+    value = str(value)
+    if len(value) >= 8 and value[:8].isdigit():
+        return f"{value[:4]}-{value[4:6]}-{value[6:8]}"
+    return value[:10]
+
+
+def bar_arrays(data):
+    """Returns (dates, closes, volumes) for a BarArray or list of bars, dates formatted YYYY-MM-DD."""
+    bars = as_bar_array(data)
+    return [format_date(date) for date in bars.dates.tolist()], bars.closes, bars.volumes
+
+
+def _rolling(values, window, reducer):
+    values = np.asarray(values, dtype=float)
+    out = np.full(values.shape, np.nan)
+    if values.shape[0] >= window:
+        out[window - 1:] = reducer(sliding_window_view(values, window, axis=0), axis=-1)
+    return out
+
+
+def sma(values, window):
+    return _rolling(values, window, np.mean)
+
+
+def rolling_max(values, window):
+    return _rolling(values, window, np.max)
+
+
+def shift(values, periods=1):
+    """Lags values by `periods` days, so day i sees day i - periods."""
+    values = np.asarray(values, dtype=float)
+    out = np.full(values.shape, np.nan)
+    if periods < values.shape[0]:
+        out[periods:] = values[:-periods]
+    return out
+
+
+def consecutive(mask):
+    """Number of consecutive True values ending at each day."""
+    mask = np.asarray(mask, dtype=bool)
+    index = np.arange(mask.shape[0]).reshape((-1,) + (1,) * (mask.ndim - 1))
+    last_false = np.maximum.accumulate(np.where(mask, -1, index), axis=0)
+    return index - last_false
+
+
+def breakout_signals(closes, volumes):
+    """
+    Marks the days where all three Stage 2 breakout rules hold:
+    close above the highest close of the prior RESISTANCE_WINDOW days,
+    SMA_SHORT above SMA_LONG, and volume at least VOLUME_MULTIPLE x the prior average.
+    """
+    resistance = shift(rolling_max(closes, RESISTANCE_WINDOW))
+    average_volume = shift(sma(volumes, VOLUME_WINDOW))
+    with np.errstate(invalid="ignore"):
+        return ((closes > resistance)
+                & (sma(closes, SMA_SHORT) > sma(closes, SMA_LONG))
+                & (volumes >= VOLUME_MULTIPLE * average_volume))
+
+
+def sma_turning_down(closes):
+    sma_long = sma(closes, SMA_LONG)
+    with np.errstate(invalid="ignore"):
+        return sma_long < shift(sma_long, SLOPE_DAYS)
+
+
+def failure_signals(closes):
+    """
+    Marks the days where Stage 2 has failed: FAILURE_DAYS consecutive closes
+    below SMA_LONG, or SMA_LONG lower than it was SLOPE_DAYS ago.
+    """
+    with np.errstate(invalid="ignore"):
+        below = consecutive(closes < sma(closes, SMA_LONG)) >= FAILURE_DAYS
+    return below | sma_turning_down(closes)
+
+
+Signals = namedtuple("Signals", ["breakout", "failed", "turning_down"])
+
+
+class RollingIndicators:
+    """
+    Incremental Stage 2 indicator state for one ticker. Each update() costs O(1):
+    running sums over ring buffers for the SMAs and average volume, and a monotonic
+    queue for the highest close. Serialises with to_dict()/from_dict() so it can be
+    stored next to the cached bars and resumed without replaying the history.
+    """
+
+    def __init__(self):
+        self.last_date = None
+        self.count = 0
+        self.short_closes = deque(maxlen=SMA_SHORT)
+        self.long_closes = deque(maxlen=SMA_LONG)
+        self.volumes = deque(maxlen=VOLUME_WINDOW)
+        self.highs = deque()  # (bar number, close), closes strictly decreasing
+        self.long_smas = deque(maxlen=SLOPE_DAYS + 1)
+        self.below_count = 0  # consecutive closes below SMA_LONG
+        self.last_failure = None  # (date, close, stage) of the latest failed day
+        self._resync()
+
+    def _resync(self):
+        self.short_sum = sum(self.short_closes)
+        self.long_sum = sum(self.long_closes)
+        self.volume_sum = sum(self.volumes)
+
+    @staticmethod
+    def _push(window, total, value):
+        if len(window) == window.maxlen:
+            total -= window[0]
+        window.append(value)
+        return total + value
+
+    @property
+    def sma_short(self):
+        return self.short_sum / len(self.short_closes) if len(self.short_closes) == SMA_SHORT else np.nan
+
+    @property
+    def sma_long(self):
+        return self.long_sum / len(self.long_closes) if len(self.long_closes) == SMA_LONG else np.nan
+
+    @property
+    def average_volume(self):
+        return self.volume_sum / len(self.volumes) if len(self.volumes) == VOLUME_WINDOW else np.nan
+
+    @property
+    def resistance(self):
+        """Highest close of the last RESISTANCE_WINDOW bars."""
+        return self.highs[0][1] if self.count >= RESISTANCE_WINDOW else np.nan
+
+    def update(self, date, close, volume):
+        """Adds one closed bar and returns its Signals, matching breakout_signals and failure_signals."""
+        close, volume = float(close), float(volume)
+        # Breakout compares against the prior bars' resistance and volume
+        resistance, average_volume = self.resistance, self.average_volume
+
+        self.short_sum = self._push(self.short_closes, self.short_sum, close)
+        self.long_sum = self._push(self.long_closes, self.long_sum, close)
+        self.volume_sum = self._push(self.volumes, self.volume_sum, volume)
+        while self.highs and self.highs[-1][1] <= close:
+            self.highs.pop()
+        self.highs.append((self.count, close))
+        while self.highs[0][0] <= self.count - RESISTANCE_WINDOW:
+            self.highs.popleft()
+        self.count += 1
+        self.last_date = str(date)
+
+        sma_long = self.sma_long
+        self.long_smas.append(sma_long)
+        self.below_count = self.below_count + 1 if close < sma_long else 0
+        turning_down = len(self.long_smas) > SLOPE_DAYS and sma_long < self.long_smas[0]
+        failed = self.below_count >= FAILURE_DAYS or bool(turning_down)
+        breakout = bool(close > resistance and self.sma_short > sma_long and volume >= VOLUME_MULTIPLE * average_volume)
+
+        if failed:
+            self.last_failure = (format_date(date), close, 4 if turning_down else 1)
+        return Signals(breakout, failed, bool(turning_down))
+
+    def update_bars(self, data):
+        """Feeds the bars dated after last_date, returns how many were new."""
+        bars = as_bar_array(data)
+        new = 0
+        for date, close, volume in zip(bars.dates.tolist(), bars.closes.tolist(), bars.volumes.tolist()):
+            if self.last_date is None or date > self.last_date:
+                self.update(date, close, volume)
+                new += 1
+        return new
+
+    def still_stage_2_since(self, crossover_date):
+        """
+        True if the failure rules haven't fired on or after crossover_date. False until
+        FAILURE_WARMUP bars have been seen, since before then they can't fire at all.
+        """
+        if self.count < FAILURE_WARMUP:
+            return False
+        return self.last_failure is None or self.last_failure[0] < str(crossover_date)[:10]
+
+    def to_dict(self):
+        return {
+            "last_date": self.last_date,
+            "count": self.count,
+            "short_closes": list(self.short_closes),
+            "long_closes": list(self.long_closes),
+            "volumes": list(self.volumes),
+            "highs": [list(high) for high in self.highs],
+            "long_smas": [None if np.isnan(value) else value for value in self.long_smas],
+            "below_count": self.below_count,
+            "last_failure": self.last_failure,
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        indicators = cls()
+        indicators.last_date = state["last_date"]
+        indicators.count = state["count"]
+        indicators.short_closes.extend(state["short_closes"])
+        indicators.long_closes.extend(state["long_closes"])
+        indicators.volumes.extend(state["volumes"])
+        indicators.highs.extend(tuple(high) for high in state["highs"])
+        indicators.long_smas.extend(np.nan if value is None else value for value in state["long_smas"])
+        indicators.below_count = state["below_count"]
+        indicators.last_failure = tuple(state["last_failure"]) if state["last_failure"] else None
+        # Recompute the running sums so float drift never outlives a run
+        indicators._resync()
+        return indicators
+
+    def copy(self):
+        return RollingIndicators.from_dict(self.to_dict())
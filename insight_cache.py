@@ -0,0 +1,91 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+import prompts
+from run_cache import fingerprint
+
+# Disk-backed LLM insight cache, so reruns on unchanged bars (and restarts after a
+# crash) reuse earlier answers instead of paying for the model again.
+
+INSIGHT_CACHE_PATH = os.getenv("INSIGHT_CACHE_PATH", "cache/insights.sqlite")
+TTL = 3 * 24 * 60 * 60  # seconds an insight stays valid
+MAX_ENTRIES = 20000  # least recently used insights are evicted past this
+
+_connection = None
+_lock = threading.Lock()
+
+
+def connect():
+    global _connection
+    if _connection is None:
+        os.makedirs(os.path.dirname(INSIGHT_CACHE_PATH) or ".", exist_ok=True)
+        _connection = sqlite3.connect(INSIGHT_CACHE_PATH, check_same_thread=False)
+        _connection.execute('''
+            CREATE TABLE IF NOT EXISTS insights (
+                key TEXT PRIMARY KEY,
+                ticker TEXT,
+                model TEXT,
+                created REAL,
+                accessed REAL,
+                insight TEXT
+            )
+        ''')
+        _connection.execute("CREATE INDEX IF NOT EXISTS insights_accessed ON insights (accessed)")
+        _connection.commit()
+    return _connection
+
+
+def make_key(ticker, model, kind, data):
+    """Hashes (ticker, model, template version, prompt kind, bars) into the cache key."""
+    raw = f"{ticker}|{model}|{prompts.TEMPLATE_VERSION}|{kind}|{fingerprint(data)}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def get(ticker, model, kind, data):
+    key = make_key(ticker, model, kind, data)
+    now = time.time()
+    with _lock:
+        conn = connect()
+        row = conn.execute("SELECT created, insight FROM insights WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if now - row[0] > TTL:
+            conn.execute("DELETE FROM insights WHERE key = ?", (key,))
+            conn.commit()
+            return None
+        conn.execute("UPDATE insights SET accessed = ? WHERE key = ?", (now, key))
+        conn.commit()
+    return row[1]
+
+
+def put(ticker, model, kind, data, insight):
+    key = make_key(ticker, model, kind, data)
+    now = time.time()
+    with _lock:
+        conn = connect()
+        conn.execute("INSERT OR REPLACE INTO insights VALUES (?, ?, ?, ?, ?, ?)", (key, ticker, model, now, now, insight))
+        excess = conn.execute("SELECT count(*) FROM insights").fetchone()[0] - MAX_ENTRIES
+        if excess > 0:
+            conn.execute('''
+                DELETE FROM insights WHERE key IN (
+                    SELECT key FROM insights ORDER BY accessed LIMIT ?
+                )
+            ''', (excess,))
+        conn.commit()
+
+
+def cached(ticker, model, kind, data, producer):
+    """Returns the cached insight, or calls producer() and caches its answer if it isn't None."""
+    insight = get(ticker, model, kind, data)
+    if insight is not None:
+        metrics.inc("cache_hits_total", cache="disk")
+        return insight
+
+    insight = producer()
+    if insight is not None:
+        put(ticker, model, kind, data, insight)
+    return insight
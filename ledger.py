@@ -0,0 +1,163 @@
+import datetime as dt
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Persistent per-ticker work ledger, so a scan restarted after a crash skips the
+# tickers it already finished and only redoes unfinished or failed ones. A run that
+# finished is never resumed: the next run with the same arguments starts fresh.
+
+# Ensure the same logger is used
+logger = logging.getLogger('main')  # This should match the logger name from main.py
+
+LEDGER_PATH = os.getenv("LEDGER_PATH", "cache/ledger.sqlite")
+MAX_ATTEMPTS = 5  # failures across restarts before a ticker is left alone for the run
+RETENTION_DAYS = 7  # runs started longer ago than this are pruned
+
+FETCHED = "fetched"
+FILTERED = "filtered"  # failed the liquidity filter or the Stage 2 screen
+CLASSIFIED = "classified"  # classified as anything but Stage 2
+STAGE2 = "stage2"  # Stage 2, open queued until the tracker is flushed
+TRACKED = "tracked"
+CHECKED = "checked"  # open position still in Stage 2
+CLOSING = "closing"  # close queued until the tracker is flushed
+CLOSED = "closed"
+FAILED = "failed"
+
+DONE = {FILTERED, CLASSIFIED, TRACKED, CHECKED, CLOSED}
+# Queued tracking writes only count as done once flushed
+SETTLES = {STAGE2: TRACKED, CLOSING: CLOSED}
+
+_connection = None
+_lock = threading.Lock()
+
+
+def connect():
+    global _connection
+    if _connection is None:
+        os.makedirs(os.path.dirname(LEDGER_PATH) or ".", exist_ok=True)
+        _connection = sqlite3.connect(LEDGER_PATH, check_same_thread=False)
+        _connection.execute('''
+            CREATE TABLE IF NOT EXISTS ledger (
+                run_id TEXT,
+                ticker TEXT,
+                state TEXT,
+                attempts INTEGER DEFAULT 0,
+                error TEXT,
+                updated REAL,
+                PRIMARY KEY (run_id, ticker)
+            )
+        ''')
+        _connection.execute('''
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                run_key TEXT,
+                started REAL,
+                finished REAL
+            )
+        ''')
+        prune(_connection)
+        _connection.commit()
+    return _connection
+
+
+def prune(conn, days=RETENTION_DAYS):
+    """Deletes the runs started more than `days` ago, with their tickers."""
+    cutoff = time.time() - days * 86400
+    conn.execute("DELETE FROM ledger WHERE updated < ?", (cutoff,))
+    conn.execute("DELETE FROM runs WHERE started < ?", (cutoff,))
+
+
+def run_key(*parts, day=None):
+    """Runs over the same arguments on the same day share a key, so a restart the same day can resume."""
+    return ":".join([(day or dt.date.today()).isoformat(), *map(str, parts)])
+
+
+class RunLedger:
+    def __init__(self, run_key):
+        """Resumes the unfinished run with this key, or starts a new one if every earlier run finished."""
+        self.run_key = run_key
+        with _lock:
+            conn = connect()
+            row = conn.execute("SELECT run_id FROM runs WHERE run_key = ? AND finished IS NULL ORDER BY started DESC LIMIT 1",
+                               (run_key,)).fetchone()
+            if row:
+                self.run_id = row[0]
+            else:
+                count, = conn.execute("SELECT COUNT(*) FROM runs WHERE run_key = ?", (run_key,)).fetchone()
+                self.run_id = f"{run_key}#{count + 1}"
+                conn.execute("INSERT INTO runs (run_id, run_key, started) VALUES (?, ?, ?)", (self.run_id, run_key, time.time()))
+                conn.commit()
+
+    def states(self):
+        """{ticker: (state, attempts)} for the run."""
+        with _lock:
+            rows = connect().execute("SELECT ticker, state, attempts FROM ledger WHERE run_id = ?", (self.run_id,)).fetchall()
+        return {ticker: (state, attempts) for ticker, state, attempts in rows}
+
+    def pending(self, tickers):
+        """The tickers still to do: not done, and not failed MAX_ATTEMPTS times already."""
+        states = self.states()
+        todo = [ticker for ticker in tickers
+                if states.get(ticker, (None, 0))[0] not in DONE and states.get(ticker, (None, 0))[1] < MAX_ATTEMPTS]
+        done = sum(state in DONE for state, _ in states.values())
+        given_up = sum(state == FAILED and attempts >= MAX_ATTEMPTS for state, attempts in states.values())
+        if done or given_up:
+            logger.info(f"Resuming run {self.run_id}: {done} done, {given_up} given up after {MAX_ATTEMPTS} failures, {len(todo)} to do")
+        return todo
+
+    def mark(self, ticker, state):
+        with _lock:
+            conn = connect()
+            conn.execute('''
+                INSERT INTO ledger (run_id, ticker, state, updated) VALUES (?, ?, ?, ?)
+                ON CONFLICT (run_id, ticker) DO UPDATE SET state = excluded.state, error = NULL, updated = excluded.updated
+            ''', (self.run_id, ticker, state, time.time()))
+            conn.commit()
+
+    def fail(self, ticker, error):
+        with _lock:
+            conn = connect()
+            conn.execute('''
+                INSERT INTO ledger (run_id, ticker, state, attempts, error, updated) VALUES (?, ?, ?, 1, ?, ?)
+                ON CONFLICT (run_id, ticker) DO UPDATE SET state = excluded.state, attempts = attempts + 1,
+                    error = excluded.error, updated = excluded.updated
+            ''', (self.run_id, ticker, FAILED, str(error), time.time()))
+            conn.commit()
+
+    def settle(self):
+        """Marks the queued opens and closes done, call once the tracker has been flushed."""
+        with _lock:
+            conn = connect()
+            for queued, done in SETTLES.items():
+                conn.execute("UPDATE ledger SET state = ?, updated = ? WHERE run_id = ? AND state = ?",
+                             (done, time.time(), self.run_id, queued))
+            conn.commit()
+
+    def finish(self):
+        """Marks the run complete, so the next one with the same key starts fresh. Call after settle()."""
+        with _lock:
+            conn = connect()
+            conn.execute("UPDATE runs SET finished = ? WHERE run_id = ?", (time.time(), self.run_id))
+            conn.commit()
+
+
+class NullLedger:
+    """Stands in when a caller doesn't want a ledger: everything is pending and nothing is recorded."""
+
+    def pending(self, tickers):
+        return list(tickers)
+
+    def mark(self, ticker, state):
+        pass
+
+    def fail(self, ticker, error):
+        pass
+
+    def settle(self):
+        pass
+
+    def finish(self):
+        pass
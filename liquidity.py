@@ -0,0 +1,89 @@
+import warnings
+from collections import namedtuple
+
+import numpy as np
+
+import metrics
+from bars import build_panel
+
+# Dollar-volume liquidity checks for one ticker or a whole batch in one vectorized pass.
+
+METRICS = ("average", "median", "recent_average", "min_day")
+RECENT_DAYS = 20  # window for recent_average and min_day
+
+LiquidityResult = namedtuple("LiquidityResult", ["ticker", "passed", "metrics"])
+
+
+class LiquidityFilter:
+    """
+    Passes tickers whose `metric` dollar volume is over dollar_size_limit and, if
+    min_day_floor is set, whose quietest day in the last recent_days is at least the floor.
+
+    Metrics, all in close x volume dollars:
+        average: mean over the whole window (the original all-window check)
+        median: median over the whole window, robust to a single block trade
+        recent_average: mean over the last recent_days
+        min_day: lowest single day in the last recent_days
+    """
+
+    def __init__(self, dollar_size_limit, metric="average", recent_days=RECENT_DAYS, min_day_floor=None):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown liquidity metric {metric}, expected one of {METRICS}")
+        self.dollar_size_limit = float(dollar_size_limit)
+        self.metric = metric
+        self.recent_days = recent_days
+        self.min_day_floor = None if min_day_floor is None else float(min_day_floor)
+
+    def evaluate_batch(self, bars_by_ticker):
+        """Returns a LiquidityResult per ticker, in input order. Tickers without bars fail with no metrics."""
+        results = self._evaluate(bars_by_ticker)
+        passed = sum(result.passed for result in results)
+        metrics.inc("filtered_total", passed, result="passed")
+        metrics.inc("filtered_total", len(results) - passed, result="rejected")
+        return results
+
+    def _evaluate(self, bars_by_ticker):
+        with_bars = {ticker: data for ticker, data in bars_by_ticker.items() if len(data)}
+        results = {ticker: LiquidityResult(ticker, False, {}) for ticker in bars_by_ticker}
+        if not with_bars:
+            return list(results.values())
+
+        tickers, closes, volumes = build_panel(with_bars)
+        passed, columns = self.passes(closes * volumes)
+
+        for i, ticker in enumerate(tickers):
+            values = {name: float(column[i]) for name, column in columns.items()}
+            results[ticker] = LiquidityResult(ticker, bool(passed[i]), values)
+        return list(results.values())
+
+    def passes(self, dollar_volume):
+        """
+        Applies the filter to a days x tickers dollar volume window, NaN before a ticker's
+        first bar. Returns (passed, columns): a boolean per ticker and each metric's values.
+        """
+        recent = dollar_volume[-self.recent_days:]
+        with warnings.catch_warnings():
+            # A ticker with no bars in the window gets NaN metrics and fails
+            warnings.simplefilter("ignore", RuntimeWarning)
+            columns = {
+                "average": np.nanmean(dollar_volume, axis=0),
+                "median": np.nanmedian(dollar_volume, axis=0),
+                "recent_average": np.nanmean(recent, axis=0),
+                "min_day": np.nanmin(recent, axis=0),
+            }
+
+            passed = columns[self.metric] > self.dollar_size_limit
+            if self.min_day_floor is not None:
+                passed &= columns["min_day"] >= self.min_day_floor
+        return passed, columns
+
+    def evaluate(self, ticker, data):
+        return self.evaluate_batch({ticker: data})[0]
+
+    def describe(self, result):
+        if not result.metrics:
+            return f"No data available {result.ticker}"
+        verdict = "Keeping" if result.passed else "Kicking out"
+        side = "over" if result.passed else "under"
+        metrics = ", ".join(f"{name} {value:,.0f}" for name, value in result.metrics.items())
+        return f"{verdict} stock {result.ticker} {side} {self.dollar_size_limit:,.0f} {self.metric} dollar volume ({metrics})"
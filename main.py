@@ -1,14 +1,22 @@
 import logging
-import re
 import sys
 import threading
-import time
-from importlib import import_module
 from logging.handlers import TimedRotatingFileHandler
 
+import backends
+import bar_store
 import fetch_data as market_data
 import ibkr  # Import the function from ibkr.py
+import insight_cache
+import ledger
+import liquidity
+import metrics
+import pipeline
+import prompts
+import run_cache
+import screener
 import track_recommedations as tr
+from trade_data import MAX_HISTORICAL_IN_FLIGHT
 
 # Create a handler that rotates the log file at midnight
 rotating_handler = TimedRotatingFileHandler(
@@ -36,12 +44,57 @@ logger = logging.getLogger(__name__)
 
 
 port = 4002
-
-def get_ticker_data(app, ticker, currency, duration, bar_size, dollar_size_limit):
-    total_data = ibkr.getData(app, ticker, currency, duration, bar_size, dollar_size_limit, None)
+# Concurrent IB historical requests during a scan, one per open request IB allows
+FETCH_WORKERS = MAX_HISTORICAL_IN_FLIGHT
+SCREEN_BATCH = 50  # tickers screened together in one vectorized panel
+LIQUIDITY_METRIC = "average"  # average, median, recent_average or min_day dollar volume
+LIQUIDITY_RECENT_DAYS = 20
+LIQUIDITY_MIN_DAY_FLOOR = None  # optional minimum dollar volume for every recent day
+# Listing filters applied before any IB request. ASX listings have no sector or market cap,
+# so these only narrow NASDAQ; stocks with an unknown value are always kept
+UNIVERSE_SECTORS = None  # only scan these sectors, e.g. ["Technology", "Health Care"]
+UNIVERSE_EXCLUDE_SECTORS = None  # never scan these sectors
+UNIVERSE_MIN_MARKET_CAP = None  # minimum market cap in dollars
+IB_READY_TIMEOUT = 8  # seconds to wait for the gateway's nextValidId after connecting
+# Let the stored incremental indicators confirm open positions without asking the model
+TRUST_INDICATOR_STATE = False
+
+def liquidity_filter(dollar_size_limit):
+    """The liquidity filter from the LIQUIDITY_* settings, used by both the scan and the open-position check."""
+    return liquidity.LiquidityFilter(dollar_size_limit, LIQUIDITY_METRIC, LIQUIDITY_RECENT_DAYS, LIQUIDITY_MIN_DAY_FLOOR)
+
+
+def universe_filters():
+    """The UNIVERSE_* settings as universe.filter_universe arguments."""
+    return {"sectors": UNIVERSE_SECTORS, "exclude_sectors": UNIVERSE_EXCLUDE_SECTORS, "min_market_cap": UNIVERSE_MIN_MARKET_CAP}
+
+
+@metrics.timed("get_ticker_data_seconds")
+def get_ticker_data(app, ticker, currency, duration, bar_size):
+    # Unfiltered, so the scan can reuse cached bars and apply its own filter
+    total_data = ibkr.fetch_bars(app, ticker, currency, duration, bar_size, None)
     return total_data
 
 
+def get_insight(backend, ticker, data, cache, crossover_date=None, crossover_price=None):
+    kind = run_cache.prompt_kind(crossover_date, crossover_price)
+    generate = lambda: backend.generate_insight(ticker, data, crossover_date, crossover_price)
+    # Run cache first, then the on-disk cache from earlier runs, then the backend
+    return cache.get_insight(ticker, kind, data, lambda: insight_cache.cached(ticker, backend.key, kind, data, generate))
+
+
+def indicator_state_holds(ticker, currency, bar_size, data, crossover_date):
+    """Checks the Stage 2 failure rules on the stored incremental indicators plus the latest bars."""
+    state = bar_store.load_state(ticker, currency, bar_size)
+    if state is None or crossover_date is None:
+        return False
+    # Apply the possibly still forming latest bar to a copy, not the stored state
+    state = state.copy()
+    state.update_bars(data)
+    return state.still_stage_2_since(crossover_date)
+
+
+@metrics.timed("extract_stage_and_date_seconds")
 def extract_stage_and_date(text):
     """
     Extracts the stage, crossover date, and crossover price from text like:
@@ -52,9 +105,7 @@ def extract_stage_and_date(text):
     Returns:
         (stage, cross_date, cross_price)
     """
-    # Regex matches "STAGEX [Crossover] on YYYY-MM-DD at $PRICE"
-    pattern = r'\b(STAGE\d{1,2})\b(?:\s+Crossover)?\s+on\s+(\d{4}-\d{2}-\d{2})\s+at\s+\$([0-9]*\.?[0-9]+)'
-    match = re.search(pattern, text, re.IGNORECASE)
+    match = prompts.ANSWER_PATTERN.search(text)
 
     if match:
         stage = match.group(1).upper()
@@ -64,48 +115,114 @@ def extract_stage_and_date(text):
     else:
         return None, None, None
 
-def process_data(app, exchange, currency, duration, bar_size, import_module, model_name, dollar_size_limit, trade_amount):
-    # Initialize logging
-    logger.info("Stock Analysis Application Started")
 
-    try:
-        method = getattr(market_data, exchange, None);
-        tickers = method(logger)
-
-        if tickers:
-            for ticker in tickers:
-                data = get_ticker_data(app, ticker, currency, duration, bar_size, dollar_size_limit)
+def scan_tickers(app, tickers, currency, duration, bar_size, backend, dollar_size_limit, trade_amount, cache=None, tracker=tr, run_ledger=None):
+    """
+    Runs tickers through fetch, filter, classify and persist, tracking Stage 2 hits with tracker.
+    With a run_ledger, tickers it already has as done are skipped and each ticker's progress is recorded.
+    """
+    cache = cache or run_cache.RunCache()
+    run_ledger = run_ledger or ledger.NullLedger()
+    scan_filter = liquidity_filter(dollar_size_limit)
+    tickers = run_ledger.pending(tickers)
+
+    def fetch(batch):
+        fetched = []
+        for ticker in batch:
+            try:
+                # Bars already fetched this run (open positions) skip the network
+                data = cache.bars[ticker] if cache.has_bars(ticker) else ibkr.fetch_bars(app, ticker, currency, duration, bar_size, None)
+            except Exception as e:
+                logger.error(f"Fetching {ticker} failed: {e}")
+                run_ledger.fail(ticker, e)
+                continue
+            run_ledger.mark(ticker, ledger.FETCHED)
+            fetched.append((ticker, data))
+        return fetched
+
+    def screen(batch):
+        fetched = dict(batch)
+        liquid = {}
+        # One vectorized liquidity pass over the whole batch
+        for result in scan_filter.evaluate_batch(fetched):
+            logger.info(scan_filter.describe(result))
+            data = fetched[result.ticker] if result.passed else []
+            cache.put_bars(result.ticker, data)
+            cache.liquidity[result.ticker] = result.metrics
+            if result.passed:
+                liquid[result.ticker] = data
+
+        # Only tickers that pass the cheap vectorized Stage 2 screen reach the LLM
+        candidates = screener.screen(liquid, logger)
+        for ticker in set(fetched).difference(candidates):
+            run_ledger.mark(ticker, ledger.FILTERED)
+        return [(ticker, liquid[ticker]) for ticker in candidates]
+
+    def classify(batch):
+        classified = []
+        for ticker, data in batch:
+            try:
+                # Generate insight
+                insight = get_insight(backend, ticker, data, cache)
+            except Exception as e:
+                logger.error(f"Classifying {ticker} failed: {e}")
+                insight = None
+            if insight is None:
+                run_ledger.fail(ticker, "no insight")
+            classified.append((ticker, data, insight))
+        return classified
+
+    def persist(batch):
+        tracked = []
+        for ticker, data, insight in batch:
+            if insight is not None:
+                stage, open_cross_date, open_cross_price = extract_stage_and_date(insight)
+                # Only track the stock if its stage is Stage 2
+                if stage != None and stage.lower() == 'stage2' :
+
+                    # --- PLACE ORDER LOGIC HERE ---
+                    # Example: Calculate volume, price, etc.
+                    # buy_price = data[-1].close
+                    # volume = int(float(trade_amount)/float(buy_price))
+                    # action = "BUY"  # or "put" if you mean options; "BUY" for long stock
+                    # # Place the order
+                    # order_result = ibkr.place_order(app, ticker, buy_price, action, exchange, currency, volume)
+                    # logger.info(f"Order placed for {ticker}: {order_result}")
+
+                    tracker.track_stock(ticker, stage=stage, price=data[-1].close, open_cross_date=open_cross_date, open_cross_price=open_cross_price)
+                    logger.info(f"ticker == {ticker} stage == {stage} data== {data}")
+                    run_ledger.mark(ticker, ledger.STAGE2)
+                    tracked.append(ticker)
+
+                    # Optional: place stop-loss after order fill
+                    # stop_loss_price = buy_price * (1 - stop_pct)
+                    # place_stop_loss(app, ticker, stop_loss_price, volume, exchange, currency)
+                else:
+                    run_ledger.mark(ticker, ledger.CLASSIFIED)
 
-                if data:
-                    # Generate insight
-                    if len(model_name) > 0:
-                        insight = import_module.generate_insight(ticker, model_name, logger, data)
-                    else:
-                        insight = import_module.generate_insight(ticker, logger, data, None, None)
+            else:
+                logger.info(f"ticker == {ticker} has no insights as no data found")
+        return tracked
 
-                    if insight is not None:
-                        stage, open_cross_date, open_cross_price = extract_stage_and_date(insight)
-                        # Only track the stock if its stage is Stage 2
-                        if stage != None and stage.lower() == 'stage2' :
+    # Each stage has its own concurrency so IB downloads overlap with LLM calls
+    return pipeline.run(tickers, [
+        pipeline.Stage("fetch", fetch, workers=FETCH_WORKERS),
+        pipeline.Stage("filter", screen, batch=SCREEN_BATCH),
+        pipeline.Stage("classify", classify, workers=backend.max_concurrency),
+        pipeline.Stage("persist", persist),
+    ])
 
-                            # --- PLACE ORDER LOGIC HERE ---
-                            # Example: Calculate volume, price, etc.
-                            # buy_price = data[-1].close
-                            # volume = int(float(trade_amount)/float(buy_price))
-                            # action = "BUY"  # or "put" if you mean options; "BUY" for long stock
-                            # # Place the order
-                            # order_result = ibkr.place_order(app, ticker, buy_price, action, exchange, currency, volume)
-                            # logger.info(f"Order placed for {ticker}: {order_result}")
 
-                            tr.track_stock(ticker, stage=stage, price=data[-1].close, open_cross_date=open_cross_date, open_cross_price=open_cross_price)
-                            logger.info(f"ticker == {ticker} stage == {stage} data== {data}")
+def process_data(app, exchange, currency, duration, bar_size, backend, dollar_size_limit, trade_amount, cache=None, tracker=tr, run_ledger=None):
+    # Initialize logging
+    logger.info("Stock Analysis Application Started")
 
-                            # Optional: place stop-loss after order fill
-                            # stop_loss_price = buy_price * (1 - stop_pct)
-                            # place_stop_loss(app, ticker, stop_loss_price, volume, exchange, currency)
+    try:
+        method = getattr(market_data, exchange, None);
+        tickers = method(logger, **universe_filters())
 
-                    else:
-                        logger.info(f"ticker == {ticker} has no insights as no data found")
+        if tickers:
+            return scan_tickers(app, tickers, currency, duration, bar_size, backend, dollar_size_limit, trade_amount, cache, tracker, run_ledger)
         else:
             logger.warning(f"No stock data available from {exchange}")
 
@@ -114,26 +231,33 @@ def process_data(app, exchange, currency, duration, bar_size, import_module, mod
 
 
 
-def check_db_stocks_still_stage_2(app, currency, duration, bar_size, import_module, model_name, dollar_size_limit):
+def check_db_stocks_still_stage_2(app, currency, duration, bar_size, backend, dollar_size_limit, cache=None, tracker=tr, run_ledger=None):
     open_positions = tr.get_open_positions()
+    cache = cache or run_cache.RunCache()
+    run_ledger = run_ledger or ledger.NullLedger()
+    check_filter = liquidity_filter(dollar_size_limit)
+    pending = set(run_ledger.pending([rec["ticker"] for rec in open_positions]))
 
     for rec in open_positions:
         ticker = rec["ticker"]
+        if ticker not in pending:
+            continue
         buy_date = rec["open_date"]
         open_crossover_date = rec["open_crossover_date"]
         open_crossover_price = rec["open_crossover_price"]
         print(f"Checking {ticker} flagged on {buy_date}")
 
         try:
-            # Fetch latest market data
-            data = get_ticker_data(app, ticker, currency, duration, bar_size, dollar_size_limit)
-
-            if data:
+            # Fetch latest market data, the cache keeps the unfiltered bars for the scan
+            data = cache.get_bars(ticker, lambda: get_ticker_data(app, ticker, currency, duration, bar_size))
+            data = ibkr.filter_by_dollar_volume(ticker, data, dollar_size_limit, check_filter)
+
+            if data and TRUST_INDICATOR_STATE and indicator_state_holds(ticker, currency, bar_size, data, open_crossover_date):
+                logger.info(f"{ticker} is still in stage2")
+                run_ledger.mark(ticker, ledger.CHECKED)
+            elif data:
                 # Generate insight using the same process_data logic
-                if model_name:
-                    insight = import_module.generate_insight(ticker, model_name, logger, data)
-                else:
-                    insight = import_module.generate_insight(ticker, logger, data, crossover_date=open_crossover_date, crossover_price=open_crossover_price)
+                insight = get_insight(backend, ticker, data, cache, open_crossover_date, open_crossover_price)
 
                 if insight:
                     stage, close_crossover_date, close_crossover_price = extract_stage_and_date(insight)
@@ -142,16 +266,21 @@ def check_db_stocks_still_stage_2(app, currency, duration, bar_size, import_modu
                         close_date = data[-1].date
                         close_price = data[-1].close
                         print(f"Closing {ticker}: moved to {stage} on {close_crossover_date} at {close_crossover_price}")
-                        tr.update_close_info(ticker, close_date=close_date, close_price=close_price, close_crossover_date=close_crossover_date, close_crossover_price=close_crossover_price)
+                        tracker.update_close_info(ticker, close_date=close_date, close_price=close_price, close_crossover_date=close_crossover_date, close_crossover_price=close_crossover_price)
                         logger.info(f"{ticker} is no longer in stage2 but now in {stage}")
+                        run_ledger.mark(ticker, ledger.CLOSING)
                     else:
                         logger.info(f"{ticker} is still in stage2")
+                        run_ledger.mark(ticker, ledger.CHECKED)
                 else:
                     logger.info(f"No insight returned for {ticker}")
+                    run_ledger.fail(ticker, "no insight")
             else:
                 logger.info(f"No data available for {ticker}")
+                run_ledger.mark(ticker, ledger.CHECKED)
         except Exception as e:
             logger.error(f"Error checking {ticker}: {e}")
+            run_ledger.fail(ticker, e)
 
 
 if __name__ == "__main__":
@@ -177,15 +306,32 @@ if __name__ == "__main__":
     # Initialize IBKR connection using the setup function
     app = ibkr.setup_ibkr()  # Call the imported function
     threading.Thread(target=app.run, daemon=True).start()
-    time.sleep(3)
 
-    if not app.valid_id_received.wait(timeout=5):
+    # Set up the backend and the database while the gateway handshake is in flight
+    # A backend name or a cascade like rules,gemini, see backends.create
+    backend = backends.create(llm, model_name)
+    # Ensure the database is initialized before processing data
+    tr.initialize_db()
+
+    if not app.valid_id_received.wait(timeout=IB_READY_TIMEOUT):
         print("Failed to receive nextValidId")
         exit()
 
-    imported_module = import_module(llm)
-
-    # Ensure the database is initialized before processing data
-    tr.initialize_db()
-    check_db_stocks_still_stage_2(app, currency, duration, bar_size, imported_module, model_name, dollar_size_limit)
-    process_data(app, exchange, currency, duration, bar_size, imported_module, model_name, dollar_size_limit, trade_amount)
+    # Both passes share one fetch and one insight per ticker and prompt
+    cache = run_cache.RunCache()
+    # Opens and closes are queued and written in one transaction at the end of the run
+    tracker = tr.TrackingBatch()
+    # A restart after a crash on the same day resumes these, a run after a finished one starts over
+    check_ledger = ledger.RunLedger(ledger.run_key("check", currency, duration, bar_size, llm, model_name))
+    scan_ledger = ledger.RunLedger(ledger.run_key("scan", exchange, currency, duration, bar_size, llm, model_name))
+    check_db_stocks_still_stage_2(app, currency, duration, bar_size, backend, dollar_size_limit, cache, tracker, check_ledger)
+    process_data(app, exchange, currency, duration, bar_size, backend, dollar_size_limit, trade_amount, cache, tracker, scan_ledger)
+    logger.info(f"Wrote {tracker.flush()} tracking updates")
+    if not len(tracker):
+        # Flushed, so the queued opens and closes are in the database
+        check_ledger.settle()
+        scan_ledger.settle()
+        check_ledger.finish()
+        scan_ledger.finish()
+    logger.info(metrics.summary())
+    logger.info(f"Metrics written to {metrics.write_textfile()}")
@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# In-process counters and latency histograms for a run. Written out as a Prometheus
+# text file (for node_exporter's textfile collector) and summarised at the end of a run.
+
+METRICS_PATH = os.getenv("METRICS_PATH", "cache/stan.prom")
+PREFIX = "stan_"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # seconds
+
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> Histogram
+_lock = threading.Lock()
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation, max for the +Inf bucket."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    with _lock:
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, value, **labels):
+    with _lock:
+        key = _key(name, labels)
+        if key not in _histograms:
+            _histograms[key] = Histogram()
+        _histograms[key].observe(value)
+
+
+@contextmanager
+def timer(name, **labels):
+    """Observes the seconds spent in the block, including when it raises."""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - started, **labels)
+
+
+def timed(name, **labels):
+    """Decorator form of timer()."""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def render():
+    """The current metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(_histograms.items(), key=lambda item: item[0])
+        for name in sorted({name for (name, _), _ in counters}):
+            lines.append(f"# TYPE {PREFIX}{name} counter")
+            lines.extend(f"{PREFIX}{name}{_labels(labels)} {value}" for (n, labels), value in counters if n == name)
+        for name in sorted({name for (name, _), _ in histograms}):
+            lines.append(f"# TYPE {PREFIX}{name} histogram")
+            for (n, labels), histogram in histograms:
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{PREFIX}{name}_bucket{_labels(labels, le=bound)} {cumulative}")
+                lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {histogram.sum}")
+                lines.append(f"{PREFIX}{name}_count{_labels(labels)} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path=None):
+    """Writes render() to path atomically, so a collector never reads half a file."""
+    path = path or METRICS_PATH
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w") as file:
+        file.write(render())
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def summary():
+    """End-of-run summary: where the time went, then the counters."""
+    lines = ["Run metrics:"]
+    with _lock:
+        histograms = sorted(_histograms.items(), key=lambda item: -item[1].sum)
+        counters = sorted(_counters.items())
+    for (name, labels), h in histograms:
+        lines.append(f"  {name}{_labels(labels)}: {h.count} calls, {h.sum:.1f}s total, "
+                     f"mean {h.sum / h.count * 1000:.1f}ms, p95 <= {h.quantile(0.95) * 1000:.0f}ms, max {h.max * 1000:.0f}ms")
+    for (name, labels), value in counters:
+        lines.append(f"  {name}{_labels(labels)}: {value:g}")
+    return "\n".join(lines)
@@ -0,0 +1,180 @@
+import logging
+import sys
+import threading
+import time
+
+import bar_store
+import indicators as ind
+import track_recommedations as tr
+
+# Monitor mode: instead of re-downloading history for every open position each run,
+# subscribe to keepUpToDate bars and re-check the Stage 2 failure rules whenever a bar closes.
+
+# Ensure the same logger is used
+logger = logging.getLogger('main')  # This should match the logger name from main.py
+
+MONITOR_DURATION = "90 D"  # initial window, enough closes for the 30-day SMA and its slope
+RESUBSCRIBE_ATTEMPTS = 3  # times in a row a dead subscription is renewed before the ticker is dropped
+
+
+class PositionWindow:
+    """Incremental indicators over one open position's closed bars, plus the bar IB is still forming."""
+
+    def __init__(self, ticker, indicators, forming=None):
+        self.ticker = ticker
+        self.indicators = indicators
+        self.forming = forming
+
+    def close_bar(self, bar):
+        """Adds a closed bar and returns the stage it leaves the position in: 2 while Stage 2 holds, else 1 or 4."""
+        signals = self.indicators.update(bar.date, bar.close, bar.volume)
+        if not signals.failed:
+            return 2
+        return 4 if signals.turning_down else 1
+
+    def catch_up(self, bars):
+        """
+        Closes the bars a renewed subscription has that the window hasn't seen, and keeps
+        the last one as forming. Returns (stage, bar) for the first bar that ended Stage 2,
+        or None if it still holds.
+        """
+        last_date = self.indicators.last_date
+        for bar in bars[:-1]:
+            if last_date is None or str(bar.date) > last_date:
+                stage = self.close_bar(bar)
+                if stage != 2:
+                    return stage, bar
+        self.forming = bars[-1] if len(bars) else self.forming
+        return None
+
+
+def seed_indicators(ticker, currency, bar_size, bars):
+    """Starts from the stored indicator state when there is one, then applies the closed bars it hasn't seen."""
+    try:
+        indicators = bar_store.load_state(ticker, currency, bar_size)
+    except Exception as e:
+        # The store is single-writer, a running scan keeps it locked
+        logger.warning(f"Indicator state unavailable for {ticker}: {e}")
+        indicators = None
+    indicators = indicators or ind.RollingIndicators()
+    indicators.update_bars(bars[:-1])
+    return indicators
+
+
+class PositionMonitor:
+    def __init__(self, app, currency, bar_size="1 day", tracker=tr):
+        self.app = app
+        self.currency = currency
+        self.bar_size = bar_size
+        self.tracker = tracker
+        self.windows = {}  # ticker -> PositionWindow
+        self.subscriptions = {}  # ticker -> streaming HistoricalRequest
+        self.failures = {}  # ticker -> subscriptions lost in a row
+        self.lock = threading.Lock()
+
+    def _subscribe(self, ticker):
+        return self.app.subscribe_historical_data(ticker, self.currency, MONITOR_DURATION, self.bar_size,
+                                                  lambda bar: self.on_update(ticker, bar))
+
+    def watch(self, position):
+        ticker = position["ticker"]
+        request = self._subscribe(ticker)
+        bars = request.bars
+        # The last bar may still be forming, it is evaluated once the next one starts
+        indicators = seed_indicators(ticker, self.currency, self.bar_size, bars)
+        with self.lock:
+            self.windows[ticker] = PositionWindow(ticker, indicators, bars[-1] if len(bars) else None)
+            self.subscriptions[ticker] = request
+        logger.info(f"Monitoring {ticker} flagged on {position['open_date']} with {len(bars)} bars")
+
+    def on_update(self, ticker, bar):
+        with self.lock:
+            window = self.windows.get(ticker)
+            if window is None:
+                return  # not seeded yet, IB resends the forming bar
+            closed = window.forming
+            window.forming = bar
+            if closed is None or closed.date == bar.date:
+                return
+            stage = window.close_bar(closed)
+
+        if stage != 2:
+            self.close_position(ticker, closed, stage)
+
+    def close_position(self, ticker, bar, stage):
+        date = ind.format_date(bar.date)
+        print(f"Closing {ticker}: moved to STAGE{stage} on {date} at {bar.close}")
+        self.tracker.update_close_info(ticker, close_date=date, close_price=bar.close, close_crossover_date=date, close_crossover_price=bar.close)
+        logger.info(f"{ticker} is no longer in stage2 but now in STAGE{stage}")
+        self.stop(ticker)
+
+    def stop(self, ticker):
+        with self.lock:
+            self.windows.pop(ticker, None)
+            self.failures.pop(ticker, None)
+            request = self.subscriptions.pop(ticker, None)
+        if request is not None:
+            self.app.unsubscribe(request)
+
+    def check_subscriptions(self):
+        """
+        Renews subscriptions IB has ended, which the app drops from its requests on an
+        error, catching up on the bars missed meanwhile. A ticker whose subscription dies
+        RESUBSCRIBE_ATTEMPTS times in a row is dropped and no longer monitored.
+        """
+        with self.lock:
+            dead = [ticker for ticker, request in self.subscriptions.items() if request.req_id not in self.app.requests]
+        for ticker in dead:
+            failures = self.failures.get(ticker, 0) + 1
+            if failures > RESUBSCRIBE_ATTEMPTS:
+                logger.error(f"Subscription for {ticker} lost {RESUBSCRIBE_ATTEMPTS} times in a row, no longer monitoring it")
+                self.stop(ticker)
+                continue
+
+            logger.warning(f"Subscription for {ticker} ended, resubscribing (attempt {failures})")
+            request = self._subscribe(ticker)
+            failed = None
+            with self.lock:
+                window = self.windows.get(ticker)
+                if window is not None:
+                    self.subscriptions[ticker] = request
+                    # Only an answered subscription resets the count, one that failed again adds to it
+                    self.failures[ticker] = 0 if len(request.bars) else failures
+                    failed = window.catch_up(request.bars)
+            if window is None:
+                # Closed while resubscribing
+                self.app.unsubscribe(request)
+            elif failed is not None:
+                self.close_position(ticker, failed[1], failed[0])
+
+    def run(self, positions, poll=60):
+        """Watches every open position until all have closed, been dropped, or the process is interrupted."""
+        for position in positions:
+            self.watch(position)
+        try:
+            while self.windows:
+                time.sleep(poll)
+                self.check_subscriptions()
+        except KeyboardInterrupt:
+            logger.info("Monitor stopped")
+        finally:
+            for ticker in list(self.subscriptions):
+                self.stop(ticker)
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+        print("Please provide a currency and optionally a barsize (1 day) as command-line arguments.")
+        sys.exit(1)
+
+    import ibkr
+    import main  # configures logging
+
+    app = ibkr.setup_ibkr()
+    threading.Thread(target=app.run, daemon=True).start()
+    if not app.valid_id_received.wait(timeout=5):
+        print("Failed to receive nextValidId")
+        exit()
+
+    PositionMonitor(app, sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "1 day").run(tr.get_open_positions())
@@ -1,51 +1,127 @@
-import pandas as pd
-from io import StringIO
+import asyncio
+import os
+import threading
 
-from ollama import chat
-from ollama import ChatResponse
-def generate_insight(ticker, model, logger):
+from ollama import AsyncClient
+
+import prompts
+
+# Local Ollama backend. Requests go through one AsyncClient on a background event loop,
+# at most MAX_CONCURRENCY at a time, with the model kept loaded between requests. Answers
+# are streamed and cut off as soon as the "STAGEX on YYYY-MM-DD at $PRICE" line is complete,
+# since on a CPU-only box every extra token the model adds after it is pure latency.
+
+OLLAMA_HOST = os.getenv("OLLAMA_HOST")  # None uses the client default, http://localhost:11434
+MODEL_NAME = "llama3.1:8b"  # used when main is given no model name
+MAX_CONCURRENCY = int(os.getenv("OLLAMA_CONCURRENCY", "2"))  # match the server's OLLAMA_NUM_PARALLEL
+KEEP_ALIVE = "30m"  # how long the server keeps the model loaded after a request
+STREAM_EARLY_STOP = True
+WITH_INDICATORS = True  # send precomputed SMA5/SMA30/volume ratio columns with the bars
+OPTIONS = {"temperature": 0}  # the same bars should get the same answer
+
+_loop = None
+_client = None
+_semaphore = None
+_loop_lock = threading.Lock()
+
+
+def _background_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, daemon=True, name="ollama").start()
+    return _loop
+
+
+def _run(coroutine):
+    """Runs a coroutine on the background loop from any thread and waits for its result."""
+    return asyncio.run_coroutine_threadsafe(coroutine, _background_loop()).result()
+
+
+def client():
+    # Created on first use inside the background loop, which the client's connections belong to
+    global _client, _semaphore
+    if _client is None:
+        _client = AsyncClient(host=OLLAMA_HOST)
+        _semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    return _client
+
+
+def answered(text):
+    """True once a complete line of text holds the stage answer, so the rest can be skipped."""
+    complete = text[:text.rfind("\n") + 1]
+    return prompts.ANSWER_PATTERN.search(complete) is not None
+
+
+async def _chat(model, prompt):
+    messages = [{"role": "user", "content": prompt}]
+    if not STREAM_EARLY_STOP:
+        response = await client().chat(model=model, messages=messages, keep_alive=KEEP_ALIVE, options=OPTIONS)
+        return response.message.content
+
+    text = ""
+    stream = await client().chat(model=model, messages=messages, stream=True, keep_alive=KEEP_ALIVE, options=OPTIONS)
+    try:
+        async for part in stream:
+            text += part.message.content
+            if answered(text):
+                break
+    finally:
+        # Closing the stream drops the connection, which stops generation on the server
+        await stream.aclose()
+    return text
+
+
+async def agenerate_insight(ticker, model, logger, data, crossover_date=None, crossover_price=None):
+    """Async form of generate_insight, for callers already running on the background loop."""
+    model = model or MODEL_NAME
+    prompt = prompts.build_prompt(ticker, data, crossover_date, crossover_price, with_indicators=WITH_INDICATORS)
+    client()
+    async with _semaphore:
+        try:
+            text = await _chat(model, prompt)
+        except Exception as e:
+            logger.error(f"Error generating insight for {ticker}: {e}")
+            return None
+    logger.info(f"Ollama {model} response for {ticker}: {text.strip()}")
+    return text
+
+
+def generate_insight(ticker, model, logger, data, crossover_date=None, crossover_price=None):
+    """
+    Classifies a ticker's in-memory bars with a local Ollama model. Safe to call from many
+    threads at once; at most MAX_CONCURRENCY requests reach the server together.
+
+    Returns:
+        str: The model's answer, or None if the request failed.
+    """
+    return _run(agenerate_insight(ticker, model, logger, data, crossover_date, crossover_price))
+
+
+def generate_insights(requests, model, logger):
     """
-    Generates an investment insight based on a given RAG status, ticker symbol,
-    5-day SMA, and 30-day SMA using the Gemini Pro model.
+    Classifies many tickers concurrently.
 
     Args:
-        rag_status (str): The RAG (Red, Amber, Green) status of the stock.
-        ticker (str): The ticker symbol of the stock.
-        sma_5 (float): The 5-day Simple Moving Average.
-        sma_30 (float): The 30-day Simple Moving Average.
+        requests: (ticker, data) or (ticker, data, crossover_date, crossover_price) tuples.
 
     Returns:
-        str: The generated investment insight, or "Insight generation failed"
-             if an error occurs.
+        dict: ticker -> answer, None for failed requests.
     """
-    try:
-        with open(f'data/{ticker}.csv', 'r') as file:
-            contents = file.read()
-
-        df = pd.read_csv(StringIO(contents), index_col='Date')
-        # Rename columns to remove spaces for easier handling
-        df.rename(columns={'Open Price': 'Open', 'Close Price': 'Close', 'High Price': 'High', 'Low Price': 'Low'},
-                  inplace=True)
-
-        # Introduce a 10-second delay before switching to the next API key
-        prompt = f" Based on the most recent crossover between the 8-day and 21-day simple moving averages (SMA), and checking if today’s Volume is greater than the 20-day average Volume: \n \
-                            Tell me: STAGE1, STAGE2, STAGE3 or STAGE4. \n \
-                            Only the final decision — no code, tell me what day the 8 day broken past the 21 day. \n \
-                            \n \
-                            {df.to_string()}"
-
-        response: ChatResponse = chat(model=model, messages=[
-            {
-                'role': 'user',
-                  'content': prompt,
-            },
-        ])
-        print(response['message']['content'])
-        # or access fields directly from the response object
-        print(response.message.content)
+    async def run_all():
+        return await asyncio.gather(*(agenerate_insight(request[0], model, logger, *request[1:]) for request in requests))
 
-        return response.message.content
+    return {request[0]: insight for request, insight in zip(requests, _run(run_all()))}
+
+
+def warm_up(model=None):
+    """
+    Starts loading the model without waiting for it, e.g. while bars are still being
+    fetched. Returns a concurrent Future for the load.
+    """
+    async def load():
+        # A request without a prompt only loads the model
+        await client().generate(model=model or MODEL_NAME, keep_alive=KEEP_ALIVE)
 
-    except Exception as e:
-        logger.error(f"Error generating insight: {e}")
-        return None  # Or handle it as needed
+    return asyncio.run_coroutine_threadsafe(load(), _background_loop())
@@ -0,0 +1,102 @@
+import logging
+import random
+import threading
+import time
+
+import metrics
+
+# Shared request budgets, one token bucket per rate-limited resource.
+# Callers block only when a bucket is actually empty instead of sleeping on every request.
+
+# Ensure the same logger is used
+logger = logging.getLogger('main')  # This should match the logger name from main.py
+
+IB_HISTORICAL = "ib_historical"
+YFINANCE = "yfinance"
+GEMINI = "gemini"  # paced per key by gemini.GeminiClientPool, not by a bucket here
+
+RETRY_ATTEMPTS = 4
+RETRY_BASE_DELAY = 2  # seconds before the first retry, doubled for each one after
+RETRY_MAX_DELAY = 60
+
+
+class TokenBucket:
+    """Allows up to `capacity` acquisitions per `period` seconds, refilled continuously."""
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.period = period
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.condition = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        """Blocks until `tokens` are available and takes them. Returns the seconds spent waiting."""
+        started = time.monotonic()
+        with self.condition:
+            while True:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return time.monotonic() - started
+                self.condition.wait((tokens - self.tokens) / self.rate)
+
+
+_buckets = {}
+_registry_lock = threading.Lock()
+
+
+def register(name, capacity, period):
+    """Creates the bucket for a resource, or returns the existing one if already registered."""
+    with _registry_lock:
+        if name not in _buckets:
+            _buckets[name] = TokenBucket(capacity, period)
+        return _buckets[name]
+
+
+def configure(name, capacity, period):
+    """Replaces a resource's budget, e.g. to split it between several processes."""
+    with _registry_lock:
+        _buckets[name] = TokenBucket(capacity, period)
+        return _buckets[name]
+
+
+def bucket(name):
+    return _buckets[name]
+
+
+def acquire(name, tokens=1):
+    waited = _buckets[name].acquire(tokens)
+    metrics.observe("pacing_wait_seconds", waited, resource=name)
+    return waited
+
+
+def retry(func, name, retry_on=(Exception,), attempts=RETRY_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+    """
+    Calls func() until it returns, retrying the retry_on exceptions with jittered
+    exponential backoff so callers hitting the same limit don't retry in lockstep.
+    Re-raises the last error once the attempts are used up.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return func()
+        except retry_on as e:
+            if attempt == attempts:
+                raise
+            delay = min(max_delay, base_delay * 2 ** (attempt - 1)) * random.uniform(0.5, 1)
+            logger.warning(f"{name} failed ({e}), retry {attempt}/{attempts - 1} in {delay:.1f}s")
+            metrics.inc("retries_total", resource=name)
+            time.sleep(delay)
+
+
+# Daily bars have no hard IB limit beyond 50 open requests, but bursts trigger soft pacing
+# violations (error 162), so allow a burst of 60 and one request per second sustained.
+register(IB_HISTORICAL, 60, 60)
+# Yahoo has no published limit; 30 requests a minute stays clear of its throttling.
+register(YFINANCE, 30, 60)
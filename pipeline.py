@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Ensure the same logger is used
+logger = logging.getLogger('main')  # This should match the logger name from main.py
+
+QUEUE_SIZE = 100  # items buffered between two stages before the upstream stage waits
+
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a pipeline. func takes a list of up to `batch` items and returns the
+    list of items to pass downstream, and runs on `workers` threads at once.
+    """
+
+    def __init__(self, name, func, workers=1, batch=1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.batch = batch
+        self.items_in = 0
+        self.items_out = 0
+        self.busy = 0.0
+        self.latencies = []  # seconds per func call, i.e. per batch
+        self.errors = 0
+        self.started = None
+        self.finished = None
+
+    def summary(self):
+        elapsed = (self.finished or time.monotonic()) - (self.started or time.monotonic())
+        per_minute = self.items_in / elapsed * 60 if elapsed > 0 else 0.0
+        return (f"{self.name}: {self.items_in} in, {self.items_out} out, {self.errors} errors, "
+                f"{per_minute:.1f}/min over {elapsed:.1f}s, {self.busy:.1f}s busy across {self.workers} workers")
+
+
+async def _take(inbox, batch):
+    """Waits for one item, then takes whatever else is already queued, up to batch items."""
+    items = [await inbox.get()]
+    while len(items) < batch and items[-1] is not _DONE and not inbox.empty():
+        items.append(inbox.get_nowait())
+    return items
+
+
+async def _run_stage(stage, inbox, outbox, executor):
+    loop = asyncio.get_running_loop()
+    stage.started = time.monotonic()
+
+    async def worker():
+        while True:
+            items = await _take(inbox, stage.batch)
+            done = items[-1] is _DONE
+            if done:
+                items.pop()
+                # Put the sentinel back so the other workers of this stage see it too
+                await inbox.put(_DONE)
+
+            if items:
+                stage.items_in += len(items)
+                started = time.monotonic()
+                try:
+                    results = await loop.run_in_executor(executor, stage.func, items)
+                except Exception as e:
+                    logger.error(f"Pipeline stage {stage.name} failed on {items}: {e}")
+                    stage.errors += len(items)
+                    results = []
+                stage.latencies.append(time.monotonic() - started)
+                stage.busy += stage.latencies[-1]
+                stage.items_out += len(results)
+                if outbox is not None:
+                    for result in results:
+                        await outbox.put(result)
+
+            if done:
+                return
+
+    await asyncio.gather(*(worker() for _ in range(stage.workers)))
+    stage.finished = time.monotonic()
+    if outbox is not None:
+        await outbox.put(_DONE)
+
+
+async def _run(items, stages):
+    queues = [asyncio.Queue(maxsize=QUEUE_SIZE) for _ in stages]
+    executor = ThreadPoolExecutor(max_workers=sum(stage.workers for stage in stages))
+
+    async def feed():
+        for item in items:
+            await queues[0].put(item)
+        await queues[0].put(_DONE)
+
+    try:
+        await asyncio.gather(
+            feed(),
+            *(_run_stage(stage, queues[i], queues[i + 1] if i + 1 < len(stages) else None, executor)
+              for i, stage in enumerate(stages))
+        )
+    finally:
+        executor.shutdown(wait=False)
+
+
+def run(items, stages):
+    """
+    Streams items through the stages, each connected to the next by a bounded queue,
+    so a slow stage (e.g. the LLM) overlaps with the stages around it.
+
+    Returns:
+        list[Stage]: The stages, with their throughput counters filled in.
+    """
+    asyncio.run(_run(items, stages))
+    for stage in stages:
+        logger.info(f"Pipeline {stage.summary()}")
+    return stages
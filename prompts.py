@@ -0,0 +1,101 @@
+import math
+import re
+
+import numpy as np
+
+import indicators as ind
+from bars import as_bar_array
+
+# Prompt templates for LLM stage analysis, built once at import, and a compact
+# OHLCV table trimmed to a token budget.
+
+# Bump when a template changes so cached insights from the old wording are not reused
+TEMPLATE_VERSION = 1
+
+BREAKOUT_TEMPLATE = (
+    "Act as a strict rules-based trading analyst. Using the provided OHLCV data, determine the first date the stock {ticker} entered Stage 2 based on the classic Stan Weinstein method.\n\n"
+    "**Stage 2 confirmation requires ALL of the following on the SAME day:**\n"
+    "1. CLOSE is ABOVE the resistance (highest CLOSE in past 6–8 weeks).\n"
+    "2. 5-day SMA is ABOVE the 30-day SMA.\n"
+    "3. Volume is at least 2× the 30-day average volume.\n\n"
+    "**Return ONLY this format. No explanation:**\n"
+    "- STAGEX on YYYY-MM-DD at $CLOSE_PRICE\n"
+)
+
+VALIDATION_TEMPLATE = (
+    "Act as a strict rules-based trading analyst. Using the provided OHLCV data, determine if Stage 2 is still valid for {ticker}.\n\n"
+    "Stage 2 breakout was previously confirmed on {crossover_date} at ${crossover_price:.2f}.\n"
+    "**Stage 2 is considered FAILED if either of the following occurs:**\n"
+    "- CLOSE remains below the 30-day SMA for 5 or more consecutive days.\n"
+    "- The 30-day SMA flattens or turns downward.\n"
+    "If failed, reclassify as Stage 1 or Stage 4 based on recent price action.\n\n"
+    "**Return ONLY ONE of the following (no explanation):**\n"
+    "- STAGEX on YYYY-MM-DD at $CLOSE_PRICE\n"
+)
+
+# The answer line both templates ask for: "STAGEX [Crossover] on YYYY-MM-DD at $PRICE"
+ANSWER_PATTERN = re.compile(r'\b(STAGE\d{1,2})\b(?:\s+Crossover)?\s+on\s+(\d{4}-\d{2}-\d{2})\s+at\s+\$([0-9]*\.?[0-9]+)', re.IGNORECASE)
+
+CSV_HEADER = "Date,Open,High,Low,Close,Volume"
+# SMA5/SMA30 are the trailing averages, VolX is volume over the prior 30-day average
+INDICATOR_HEADER = ",SMA5,SMA30,VolX"
+
+DEFAULT_MAX_TOKENS = 1500
+CHARS_PER_TOKEN = 4  # typical for Gemini and Llama tokenizers on numeric ASCII text
+
+
+def count_tokens(text):
+    """Estimates the tokens in text. Deliberately rounds up, it is used as a budget."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def instructions(ticker, crossover_date=None, crossover_price=None):
+    if crossover_date is not None and crossover_price is not None:
+        return VALIDATION_TEMPLATE.format(ticker=ticker, crossover_date=str(crossover_date)[:10],
+                                          crossover_price=float(crossover_price))
+    return BREAKOUT_TEMPLATE.format(ticker=ticker)
+
+
+def format_rows(data, with_indicators=False):
+    """
+    Formats bars as compact CSV rows with a fixed number of decimals: 2 for stocks
+    trading above $1, 4 for penny stocks, and whole-number volumes.
+    """
+    bars = as_bar_array(data)
+    dates, closes, volumes = ind.bar_arrays(bars)
+    opens, highs, lows = bars.opens, bars.highs, bars.lows
+    decimals = 2 if len(closes) and np.median(closes) >= 1 else 4
+
+    columns = [np.char.mod(f"%.{decimals}f", values) for values in (opens, highs, lows, closes)]
+    columns.append(np.char.mod("%d", volumes))
+
+    if with_indicators:
+        sma_short = ind.sma(closes, ind.SMA_SHORT)
+        sma_long = ind.sma(closes, ind.SMA_LONG)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            volume_ratio = volumes / ind.shift(ind.sma(volumes, ind.VOLUME_WINDOW))
+        for values, fmt in ((sma_short, f"%.{decimals}f"), (sma_long, f"%.{decimals}f"), (volume_ratio, "%.1f")):
+            # Leave the cell empty until there is enough history for the indicator
+            columns.append(np.where(np.isfinite(values), np.char.mod(fmt, np.nan_to_num(values)), ""))
+
+    return [",".join(row) for row in zip(dates, *columns)]
+
+
+def fit_rows(rows, max_tokens, min_rows=ind.MIN_BARS):
+    """Drops the oldest rows until the table fits in max_tokens, keeping at least min_rows."""
+    costs = np.cumsum([count_tokens(row + "\n") for row in reversed(rows)])
+    keep = max(int(np.searchsorted(costs, max_tokens, side="right")), min_rows)
+    return rows[-keep:] if keep < len(rows) else rows
+
+
+def build_prompt(ticker, data, crossover_date=None, crossover_price=None, with_indicators=False,
+                 max_tokens=DEFAULT_MAX_TOKENS):
+    """
+    Builds the stage analysis prompt for a ticker's bars, trimming the oldest bars so
+    the whole prompt fits in max_tokens without dropping below what the rules need.
+    """
+    text = instructions(ticker, crossover_date, crossover_price)
+    header = CSV_HEADER + (INDICATOR_HEADER if with_indicators else "")
+    budget = max_tokens - count_tokens(f"{text}\n{header}\n")
+    rows = fit_rows(format_rows(data, with_indicators), budget)
+    return f"{text}\n{header}\n" + "\n".join(rows)
@@ -0,0 +1,136 @@
+from bisect import bisect_left
+
+import numpy as np
+
+import indicators as ind
+
+# Deterministic drop-in for gemini/ollama_llm: applies the Stage 2 rules from the
+# LLM prompts directly to the bars and answers in the same "STAGEX on ... at $..." format.
+
+# Relative distance from a rule's threshold at which its answer stops being borderline,
+# e.g. a close 5% above resistance or a volume 5% over the required multiple
+CONFIDENCE_MARGIN = 0.05
+SLOPE_MARGIN = 0.01  # the long SMA's change over SLOPE_DAYS at which it is clearly rising
+
+
+def format_price(price):
+    return f"{price:.2f}" if price >= 1 else f"{price:.4f}"
+
+
+def format_insight(stage, date, price):
+    return f"STAGE{stage} on {date} at ${format_price(price)}"
+
+
+def classify(dates, closes, volumes, crossover_date=None):
+    """
+    Classifies a ticker from its bar arrays.
+
+    Without a crossover_date, finds the start of the current Stage 2 run: the first
+    breakout day after the most recent failure. With one, checks whether Stage 2 has
+    failed since that date and reclassifies as Stage 1 or 4 if so.
+
+    Returns:
+        (stage, index): the stage number and the bar index the stage is dated from.
+    """
+    failures = np.flatnonzero(ind.failure_signals(closes))
+    # A turned-down SMA means a decline (Stage 4), otherwise the stock is basing (Stage 1)
+    fallback = 4 if ind.sma_turning_down(closes)[-1] else 1
+
+    if crossover_date is not None:
+        start = bisect_left(dates, str(crossover_date)[:10])
+        failed = failures[failures > start]
+        if failed.size:
+            return fallback, int(failed[0])
+        return 2, min(start, len(dates) - 1)
+
+    last_failure = failures[-1] if failures.size else -1
+    breakouts = np.flatnonzero(ind.breakout_signals(closes, volumes))
+    current = breakouts[breakouts >= last_failure]
+    if current.size:
+        return 2, int(current[0])
+    return fallback, len(dates) - 1
+
+
+def _scaled(margin, scale):
+    return float(np.clip(np.nan_to_num(margin / scale), 0, 1))
+
+
+def _holding(closes):
+    """How clearly the latest bar still satisfies the Stage 2 failure rules, 0 to 1."""
+    sma_long = ind.sma(closes, ind.SMA_LONG)
+    slope = sma_long[-1] / ind.shift(sma_long, ind.SLOPE_DAYS)[-1] - 1
+    with np.errstate(invalid="ignore"):
+        below = ind.consecutive(closes < sma_long)[-1]
+    return min(_scaled(slope, SLOPE_MARGIN), 1 - below / ind.FAILURE_DAYS)
+
+
+def breakout_margins(closes, volumes, index):
+    """Relative margins of the three breakout rules on one day, negative where a rule fails."""
+    resistance = ind.shift(ind.rolling_max(closes, ind.RESISTANCE_WINDOW))[index]
+    average_volume = ind.shift(ind.sma(volumes, ind.VOLUME_WINDOW))[index]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.array([
+            closes[index] / resistance - 1,
+            ind.sma(closes, ind.SMA_SHORT)[index] / ind.sma(closes, ind.SMA_LONG)[index] - 1,
+            volumes[index] / (ind.VOLUME_MULTIPLE * average_volume) - 1,
+        ])
+
+
+def confidence(closes, volumes, stage, index, crossover_date=None):
+    """
+    How clear-cut a classify() result is, from 0 when a deciding rule input sits on its
+    threshold to 1 when every one is at least CONFIDENCE_MARGIN (SLOPE_MARGIN for the SMA
+    slope) away from it.
+    """
+    if stage != 2:
+        if crossover_date is not None:
+            # A failure rule fired, which is not a judgement call
+            return 1.0
+        # Not broken out: clear if at least one rule missed the latest bar by a wide margin
+        return _scaled(-np.nanmin(breakout_margins(closes, volumes, len(closes) - 1)), CONFIDENCE_MARGIN)
+
+    holding = _holding(closes)
+    if crossover_date is not None:
+        return holding
+    return min(_scaled(np.nanmin(breakout_margins(closes, volumes, index)), CONFIDENCE_MARGIN), holding)
+
+
+def assess(ticker, logger, data, crossover_date=None, crossover_price=None):
+    """
+    generate_insight() plus how confident the rules are in the answer.
+
+    Returns:
+        (str, float): The insight and its confidence, (None, 0.0) if there are too few bars.
+    """
+    if len(data) < ind.MIN_BARS:
+        logger.info(f"{ticker} has {len(data)} bars, {ind.MIN_BARS} needed to classify")
+        return None, 0.0
+
+    dates, closes, volumes = ind.bar_arrays(data)
+    stage, index = classify(dates, closes, volumes, crossover_date)
+
+    if stage == 2 and crossover_date is not None and crossover_price is not None:
+        insight = format_insight(stage, str(crossover_date)[:10], float(crossover_price))
+    else:
+        insight = format_insight(stage, dates[index], closes[index])
+
+    score = confidence(closes, volumes, stage, index, crossover_date)
+    logger.info(f"{ticker}: {insight} (confidence {score:.2f})")
+    return insight, score
+
+
+def generate_insight(ticker, logger, data, crossover_date=None, crossover_price=None):
+    """
+    Classifies the Weinstein stage of a ticker from its bars.
+
+    Args:
+        ticker (str): The ticker symbol of the stock.
+        logger: Application logger.
+        data (list): Bars with date, close and volume attributes.
+        crossover_date: Date Stage 2 was previously confirmed, to validate instead of detect.
+        crossover_price (float): Close on the crossover date.
+
+    Returns:
+        str: "STAGEX on YYYY-MM-DD at $PRICE", or None if there are too few bars.
+    """
+    return assess(ticker, logger, data, crossover_date, crossover_price)[0]
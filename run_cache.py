@@ -0,0 +1,73 @@
+import hashlib
+import threading
+
+import metrics
+from bars import as_bar_array
+
+# Run-scoped memoization so the open-position check and the scan share one fetch
+# per ticker and never send the same prompt twice in a run.
+
+
+def fingerprint(data):
+    """Short hash identifying a bar series by its dates, closes and volumes."""
+    bars = as_bar_array(data)
+    digest = hashlib.sha1(bars.dates.tobytes())
+    digest.update(bars.closes.tobytes())
+    digest.update(bars.volumes.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def prompt_kind(crossover_date=None, crossover_price=None):
+    """Names the prompt an insight request uses: breakout detection or validation of a known crossover."""
+    if crossover_date is None:
+        return "breakout"
+    return f"validation {crossover_date} {crossover_price}"
+
+
+class RunCache:
+    def __init__(self):
+        self.bars = {}  # ticker -> bars ([] if filtered out or no data)
+        self.insights = {}  # (ticker, prompt kind, fingerprint) -> insight text
+        self.liquidity = {}  # ticker -> liquidity metrics
+        self.lock = threading.Lock()
+
+    def has_bars(self, ticker):
+        return ticker in self.bars
+
+    def put_bars(self, ticker, data):
+        with self.lock:
+            self.bars[ticker] = data
+
+    def get_bars(self, ticker, loader):
+        """Returns the cached bars for ticker, calling loader() to fetch them on first use."""
+        if ticker not in self.bars:
+            self.put_bars(ticker, loader())
+        return self.bars[ticker]
+
+    def get_insight(self, ticker, kind, data, producer):
+        """
+        Returns the insight for this ticker, prompt kind and bar data, calling producer()
+        only the first time. Failed (None) insights are not cached so they can be retried.
+        """
+        key = (ticker, kind, fingerprint(data))
+        if key in self.insights:
+            metrics.inc("cache_hits_total", cache="run")
+            return self.insights[key]
+
+        insight = producer()
+        if insight is not None:
+            with self.lock:
+                self.insights[key] = insight
+        return insight
+
+    def invalidate(self, ticker=None):
+        """Drops everything cached for ticker, or the whole cache if ticker is None."""
+        with self.lock:
+            if ticker is None:
+                self.bars.clear()
+                self.insights.clear()
+                self.liquidity.clear()
+            else:
+                self.bars.pop(ticker, None)
+                self.liquidity.pop(ticker, None)
+                self.insights = {key: value for key, value in self.insights.items() if key[0] != ticker}
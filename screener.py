@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+import indicators as ind
+from bars import build_panel
+
+# Cross-sectional pre-screen: evaluates the Stage 2 rules for the whole universe
+# at once so only plausible candidates are sent to the (slow, rate-limited) LLM.
+
+
+def candidate_signals(closes, volumes, window=None):
+    """
+    The Stage 2 candidate rule on every day of a dates x tickers panel: the short SMA on
+    top and at least one breakout in the last `window` days, or since the first day if None.
+    """
+    breakouts = np.cumsum(ind.breakout_signals(closes, volumes), axis=0)
+    if window is not None:
+        breakouts = breakouts - np.nan_to_num(ind.shift(breakouts, window))
+    with np.errstate(invalid="ignore"):
+        return (ind.sma(closes, ind.SMA_SHORT) > ind.sma(closes, ind.SMA_LONG)) & (breakouts > 0)
+
+
+def screen_metrics(bars_by_ticker):
+    """
+    Computes the Stage 2 screen for every ticker in one pass.
+
+    Returns:
+        DataFrame indexed by ticker with the latest SMAs, resistance and volume ratio,
+        the number of breakout days in the window, and a boolean 'candidate' column.
+    """
+    tickers, closes, volumes = build_panel(bars_by_ticker)
+    if not tickers or closes.shape[0] < ind.MIN_BARS:
+        return pd.DataFrame({"candidate": np.zeros(len(tickers), dtype=bool)}, index=pd.Index(tickers, name="ticker"))
+
+    sma_short = ind.sma(closes, ind.SMA_SHORT)[-1]
+    sma_long = ind.sma(closes, ind.SMA_LONG)[-1]
+    resistance = ind.shift(ind.rolling_max(closes, ind.RESISTANCE_WINDOW))[-1]
+    average_volume = ind.shift(ind.sma(volumes, ind.VOLUME_WINDOW))[-1]
+    breakout_days = ind.breakout_signals(closes, volumes).sum(axis=0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        metrics = pd.DataFrame({
+            "close": closes[-1],
+            "sma_short": sma_short,
+            "sma_long": sma_long,
+            "resistance": resistance,
+            "volume_ratio": volumes[-1] / average_volume,
+            "breakout_days": breakout_days,
+            "candidate": candidate_signals(closes, volumes)[-1],
+        }, index=pd.Index(tickers, name="ticker"))
+    return metrics
+
+
+def screen(bars_by_ticker, logger):
+    """Returns the tickers worth sending to the LLM, in their original order."""
+    metrics = screen_metrics(bars_by_ticker)
+    candidates = metrics.index[metrics["candidate"]].tolist()
+    logger.info(f"Screened {len(metrics)} tickers, {len(candidates)} Stage 2 candidates")
+    return candidates
@@ -0,0 +1,156 @@
+import logging
+import os
+import sys
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import backends
+import bar_store
+import fetch_data as market_data
+import ibkr
+import pacing
+import run_cache
+import track_recommedations as tr
+
+# Coordinator mode: splits the universe of one or more exchanges into shards, scans
+# each shard in its own process with its own IB client ID, and writes the merged
+# tracking results back in one transaction.
+
+# Ensure the same logger is used
+logger = logging.getLogger('main')  # This should match the logger name from main.py
+
+BASE_CLIENT_ID = 10  # shard client IDs start here, leaving 0 to single-process main.py runs
+SHARD_READY_TIMEOUT = 10  # seconds to wait for a shard's nextValidId
+
+
+def store_path(job):
+    """The shard's own bar store, next to the default one."""
+    return os.path.join(os.path.dirname(bar_store.BAR_STORE_PATH),
+                        f"bars-{job['exchange']}-{job['shard']}of{job['shards']}.duckdb")
+
+
+def shard_of(ticker, shards):
+    """Stable shard number for a ticker, so each shard's bar store keeps seeing the same tickers."""
+    return zlib.crc32(ticker.encode()) % shards
+
+
+def split(tickers, shards):
+    return [[ticker for ticker in tickers if shard_of(ticker, shards) == k] for k in range(shards)]
+
+
+def plan(exchanges, shards_per_exchange, processes=None):
+    """
+    Builds one job per shard of each (exchange, currency) pair, e.g.
+    [("fetch_asx_stocks", "AUD"), ("fetch_nasdaq_stocks", "USD")], with a unique client ID each.
+    The first job of each currency also re-checks open positions in that currency, as a
+    main.py run per exchange would. Positions don't record their currency, so one listed
+    elsewhere comes back without bars and is left alone, and the job with its currency closes it.
+    """
+    import main  # deferred, main configures logging when imported
+
+    jobs = []
+    for exchange, currency in exchanges:
+        tickers = getattr(market_data, exchange)(logger, **main.universe_filters()) or []
+        for k, part in enumerate(split(tickers, shards_per_exchange)):
+            jobs.append({"exchange": exchange, "currency": currency, "shard": k, "shards": shards_per_exchange, "tickers": part})
+
+    concurrent = min(processes or len(jobs), len(jobs))
+    checked = set()
+    for i, job in enumerate(jobs):
+        job["client_id"] = BASE_CLIENT_ID + i
+        job["concurrent"] = concurrent
+        job["check_open_positions"] = job["currency"] not in checked
+        checked.add(job["currency"])
+    return jobs
+
+
+def run_shard(job, duration, bar_size, dollar_size_limit, trade_amount, llm, model_name="", port=4002, app_factory=ibkr.setup_ibkr):
+    """
+    Scans one shard in the current process and returns its TrackingBatch unflushed.
+    app_factory(port, client_id) must return a connected IBKR-like app, so a fake
+    gateway can stand in for IB.
+    """
+    import main  # deferred, main configures logging when imported
+
+    # DuckDB allows one writer per file, so each shard keeps its own bar store,
+    # merged back into the default one by the coordinator
+    bar_store.close()
+    bar_store.BAR_STORE_PATH = store_path(job)
+    # Split IB's historical request budget between the shards running at once
+    ib_budget = pacing.bucket(pacing.IB_HISTORICAL)
+    pacing.configure(pacing.IB_HISTORICAL, max(1, ib_budget.capacity // job["concurrent"]), ib_budget.period)
+
+    app = app_factory(port, job["client_id"])
+    threading.Thread(target=app.run, daemon=True).start()
+    if not app.valid_id_received.wait(timeout=SHARD_READY_TIMEOUT):
+        raise RuntimeError(f"client {job['client_id']} did not receive nextValidId")
+
+    try:
+        backend = backends.create(llm, model_name)
+        cache = run_cache.RunCache()
+        tracker = tr.TrackingBatch()
+        if job["check_open_positions"]:
+            main.check_db_stocks_still_stage_2(app, job["currency"], duration, bar_size, backend, dollar_size_limit, cache, tracker)
+        main.scan_tickers(app, job["tickers"], job["currency"], duration, bar_size, backend, dollar_size_limit, trade_amount, cache, tracker)
+        return tracker
+    finally:
+        app.disconnect()
+        # Release the file so the coordinator can merge it
+        bar_store.close()
+
+
+def run(exchanges, duration, bar_size, dollar_size_limit, trade_amount, llm, model_name="", shards_per_exchange=2,
+        processes=None, port=4002, app_factory=ibkr.setup_ibkr):
+    """
+    Scans every shard in a process pool and flushes the merged tracking updates once.
+
+    Returns:
+        int: The number of tracking updates written.
+    """
+    jobs = plan(exchanges, shards_per_exchange, processes)
+    merged = tr.TrackingBatch()
+
+    with ProcessPoolExecutor(max_workers=processes or len(jobs) or 1) as pool:
+        futures = {
+            pool.submit(run_shard, job, duration, bar_size, dollar_size_limit, trade_amount, llm, model_name, port, app_factory): job
+            for job in jobs
+        }
+        for future in as_completed(futures):
+            job = futures[future]
+            name = f"{job['exchange']} shard {job['shard'] + 1}/{job['shards']} (client {job['client_id']})"
+            try:
+                batch = future.result()
+            except Exception as e:
+                logger.error(f"{name} failed: {e}")
+                continue
+            logger.info(f"{name} scanned {len(job['tickers'])} tickers, {len(batch)} tracking updates")
+            merged.opens.update(batch.opens)
+            merged.closes.update(batch.closes)
+
+    # The open-position check, monitor and backtest read the default store
+    for job in jobs:
+        if os.path.exists(store_path(job)):
+            try:
+                bar_store.merge_store(store_path(job))
+            except Exception as e:
+                logger.error(f"Merging {store_path(job)} into {bar_store.BAR_STORE_PATH} failed: {e}")
+
+    tr.initialize_db()
+    written = merged.flush()
+    logger.info(f"Wrote {written} tracking updates from {len(jobs)} shards")
+    return written
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 8:
+        print("Please provide exchanges as method:currency pairs (fetch_asx_stocks:AUD,fetch_nasdaq_stocks:USD), duration (120 D), "
+              "barsize (1 day), dollar size limit, trade amount, classifier backend (gemini, ollama, rules or a cascade like rules,gemini), shards per exchange and optionally a model name.")
+        sys.exit(1)
+
+    exchanges = [tuple(pair.split(":")) for pair in sys.argv[1].split(",")]
+    model_name = sys.argv[8] if len(sys.argv) > 8 else ""
+
+    import main  # configures logging for the coordinator
+    run(exchanges, sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5], sys.argv[6], model_name, shards_per_exchange=int(sys.argv[7]))
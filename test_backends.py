@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+import backends
+import metrics
+
+
+class Answer(backends.Backend):
+    def __init__(self, name, insight, confidence=1.0):
+        self.name = name
+        self.verdicts = [backends.Verdict(insight, confidence)]
+        self.calls = 0
+
+    async def classify(self, ticker, data, crossover_date=None, crossover_price=None):
+        self.calls += 1
+        return self.verdicts[0]
+
+
+class Rules(Answer):
+    is_model = False
+
+
+def classify(backend):
+    return asyncio.run(backend.verdict("AAA", []))
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+
+
+def llm_calls():
+    return {dict(labels)["model"]: value for (name, labels), value in metrics._counters.items() if name == "llm_calls_total"}
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        backends.Backend()
+
+
+def test_confident_rules_answer_stops_the_cascade():
+    model = Answer("model", "STAGE1 on 2025-01-01 at $1.00")
+    cascade = backends.CascadeBackend([Rules("rules", "STAGE2 on 2025-01-01 at $1.00", 0.9), model], 0.6)
+    assert classify(cascade).insight.startswith("STAGE2")
+    assert model.calls == 0
+    assert llm_calls() == {}
+
+
+def test_unsure_rules_answer_escalates_and_counts_one_model_call():
+    model = Answer("model", "STAGE2 on 2025-01-01 at $1.00")
+    cascade = backends.CascadeBackend([Rules("rules", "STAGE2 on 2025-01-01 at $1.00", 0.3), model], 0.6)
+    assert classify(cascade).confidence == 1.0
+    assert llm_calls() == {"model": 1}
+
+
+def test_disagreeing_model_is_discounted_and_failed_model_falls_back():
+    disagree = Answer("model", "STAGE1 on 2025-01-01 at $1.00")
+    cascade = backends.CascadeBackend([Rules("rules", "STAGE2 on 2025-01-01 at $1.00", 0.3), disagree], 0.6)
+    assert classify(cascade) == backends.Verdict("STAGE1 on 2025-01-01 at $1.00", 0.5)
+
+    silent = Answer("model", None, 0.0)
+    cascade = backends.CascadeBackend([Rules("rules", "STAGE2 on 2025-01-01 at $1.00", 0.3), silent], 0.6)
+    assert classify(cascade) == backends.Verdict("STAGE2 on 2025-01-01 at $1.00", 0.3)
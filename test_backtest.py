@@ -0,0 +1,31 @@
+import numpy as np
+
+import backtest
+import liquidity
+import main
+import screener
+from bars import Bar, build_panel
+
+
+def breakout_bars(quiet_volume, days=80, breakout=70):
+    # Flat, then a rising breakout on heavy volume, then flat at the new level
+    closes = np.where(np.arange(days) < breakout, 10.0, 10.0 + 0.1 * (np.arange(days) - breakout + 1))
+    closes[breakout - 5:breakout] += np.linspace(0.01, 0.05, 5)  # short SMA over the long one
+    volumes = np.where(np.arange(days) == breakout, 10 * quiet_volume, quiet_volume)
+    volumes[-20:] = 10 * quiet_volume
+    return [Bar(f"2024{i // 28 + 1:02d}{i % 28 + 1:02d}", c, c, c, c, v) for i, (c, v) in enumerate(zip(closes, volumes))]
+
+
+def test_entries_use_mains_liquidity_settings(monkeypatch):
+    bars = {"AAA": breakout_bars(quiet_volume=1e4)}
+    assert backtest.run(bars, 500_000, 5000, liquidity_filter=liquidity.LiquidityFilter(500_000)).empty
+
+    monkeypatch.setattr(main, "LIQUIDITY_METRIC", "recent_average")
+    trades = backtest.run(bars, 500_000, 5000)
+    assert trades["ticker"].tolist() == ["AAA"]
+
+
+def test_screen_candidates_match_the_last_backtest_day():
+    bars = {"AAA": breakout_bars(1e4), "BBB": breakout_bars(1e4, breakout=40)}
+    tickers, closes, volumes = build_panel(bars)
+    assert screener.screen_metrics(bars)["candidate"].tolist() == screener.candidate_signals(closes, volumes, len(closes))[-1].tolist()
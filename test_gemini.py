@@ -0,0 +1,27 @@
+import threading
+
+import gemini
+import metrics
+
+
+def test_key_wait_is_recorded_as_pacing_wait():
+    metrics.reset()
+    pool = gemini.GeminiClientPool(["key"], request_limit=1, time_window=0.2)
+    pool.release(pool.acquire())
+    # The only key is at its limit until the first request leaves the window
+    pool.release(pool.acquire())
+
+    waits = metrics._histograms[metrics._key("pacing_wait_seconds", {"resource": "gemini"})]
+    assert waits.count == 2
+    assert waits.max >= 0.15
+
+
+def test_busy_key_wait_is_recorded():
+    metrics.reset()
+    pool = gemini.GeminiClientPool(["key"], request_limit=10, time_window=60)
+    key = pool.acquire()
+    threading.Timer(0.1, pool.release, [key]).start()
+    pool.release(pool.acquire())
+
+    waits = metrics._histograms[metrics._key("pacing_wait_seconds", {"resource": "gemini"})]
+    assert waits.max >= 0.05
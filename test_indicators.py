@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import indicators as ind
+
+
+def random_series(seed, days=200):
+    rng = np.random.default_rng(seed)
+    closes = 10 * np.exp(np.cumsum(rng.normal(0.001, 0.03, days)))
+    volumes = rng.uniform(1e4, 1e5, days) * np.where(rng.random(days) < 0.1, 4, 1)
+    dates = [f"2024{i // 28 + 1:02d}{i % 28 + 1:02d}" for i in range(days)]
+    return dates, closes, volumes
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_rolling_signals_match_vectorized(seed):
+    dates, closes, volumes = random_series(seed)
+    state = ind.RollingIndicators()
+    signals = [state.update(date, close, volume) for date, close, volume in zip(dates, closes, volumes)]
+
+    assert [s.breakout for s in signals] == ind.breakout_signals(closes, volumes).tolist()
+    assert [s.failed for s in signals] == ind.failure_signals(closes).tolist()
+    assert [s.turning_down for s in signals] == ind.sma_turning_down(closes).tolist()
+
+
+def test_resumed_state_matches_replay():
+    dates, closes, volumes = random_series(1)
+    resumed = ind.RollingIndicators()
+    for bar in zip(dates[:120], closes[:120], volumes[:120]):
+        resumed.update(*bar)
+    resumed = ind.RollingIndicators.from_dict(resumed.to_dict())
+    replayed = ind.RollingIndicators()
+    for bar in zip(dates[:120], closes[:120], volumes[:120]):
+        replayed.update(*bar)
+
+    for bar in zip(dates[120:], closes[120:], volumes[120:]):
+        assert resumed.update(*bar) == replayed.update(*bar)
+
+
+def test_short_history_is_not_trusted():
+    dates, closes, volumes = random_series(2, days=ind.FAILURE_WARMUP)
+    state = ind.RollingIndicators()
+    for bar in zip(dates[:-1], closes[:-1], volumes[:-1]):
+        state.update(*bar)
+    assert not state.still_stage_2_since(ind.format_date(dates[0]))
+
+    state.update(dates[-1], closes[-1], volumes[-1])
+    assert state.still_stage_2_since(ind.format_date(dates[0])) == (state.last_failure is None)
@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+import ledger
+
+TICKERS = ["AAA", "BBB", "CCC", "DDD"]
+
+
+@pytest.fixture(autouse=True)
+def ledger_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(ledger, "LEDGER_PATH", str(tmp_path / "ledger.sqlite"))
+    monkeypatch.setattr(ledger, "_connection", None)
+    yield
+    ledger.connect().close()
+
+
+def morning_run(key):
+    run = ledger.RunLedger(key)
+    run.mark("AAA", ledger.FILTERED)
+    run.mark("BBB", ledger.STAGE2)
+    run.mark("CCC", ledger.CHECKED)
+    return run
+
+
+def test_restart_resumes_unfinished_run():
+    key = ledger.run_key("scan", "fetch_asx_stocks", "AUD")
+    crashed = morning_run(key)
+
+    restarted = ledger.RunLedger(key)
+    assert restarted.run_id == crashed.run_id
+    # STAGE2 was queued but never flushed, so it is redone
+    assert restarted.pending(TICKERS) == ["BBB", "DDD"]
+
+
+def test_completed_run_starts_fresh():
+    key = ledger.run_key("scan", "fetch_asx_stocks", "AUD")
+    morning = morning_run(key)
+    morning.settle()
+    morning.finish()
+
+    evening = ledger.RunLedger(key)
+    assert evening.run_id != morning.run_id
+    assert evening.pending(TICKERS) == TICKERS
+
+
+def test_old_runs_are_pruned():
+    old = morning_run(ledger.run_key("scan", "fetch_asx_stocks", "AUD"))
+    conn = ledger.connect()
+    long_ago = time.time() - (ledger.RETENTION_DAYS + 1) * 86400
+    conn.execute("UPDATE runs SET started = ?", (long_ago,))
+    conn.execute("UPDATE ledger SET updated = ?", (long_ago,))
+    ledger.prune(conn)
+
+    assert conn.execute("SELECT COUNT(*) FROM runs").fetchone() == (0,)
+    assert old.states() == {}
@@ -0,0 +1,48 @@
+import insight_cache
+import main
+import run_cache
+import track_recommedations as tr
+from bars import Bar
+
+
+class StageTwoBackend:
+    key = "stage2"
+
+    def __init__(self):
+        self.asked = []
+
+    def generate_insight(self, ticker, data, crossover_date=None, crossover_price=None):
+        self.asked.append(ticker)
+        return "STAGE2 Crossover on 2024-01-01 at $1.00"
+
+
+def waking_bars(days=60, recent=20):
+    # Illiquid on average over the window, liquid over the recent days
+    return [Bar(f"2024-01-{i:02d}", 1.0, 1.0, 1.0, 1.0, 1e6 if i >= days - recent else 1e3) for i in range(days)]
+
+
+def test_check_uses_configured_liquidity_and_caches_raw_bars(tmp_path, monkeypatch):
+    monkeypatch.setattr(insight_cache, "INSIGHT_CACHE_PATH", str(tmp_path / "insights.sqlite"))
+    monkeypatch.setattr(insight_cache, "_connection", None)
+    bars = waking_bars()
+    monkeypatch.setattr(main, "LIQUIDITY_METRIC", "recent_average")
+    monkeypatch.setattr(main, "get_ticker_data", lambda app, ticker, currency, duration, bar_size: bars)
+    monkeypatch.setattr(tr, "get_open_positions", lambda: [
+        {"ticker": "AAA", "open_date": "2024-01-01", "open_crossover_date": "2024-01-01", "open_crossover_price": 1.0}])
+    backend, cache = StageTwoBackend(), run_cache.RunCache()
+
+    main.check_db_stocks_still_stage_2(None, "AUD", "60 D", "1 day", backend, 500_000, cache, tr.TrackingBatch())
+
+    assert backend.asked == ["AAA"]
+    assert cache.bars["AAA"] is bars
+
+
+def test_scan_applies_universe_filters(monkeypatch):
+    asked = {}
+    monkeypatch.setattr(main, "UNIVERSE_EXCLUDE_SECTORS", ["Utilities"])
+    monkeypatch.setattr(main, "UNIVERSE_MIN_MARKET_CAP", 300e6)
+    monkeypatch.setattr(main.market_data, "fetch_nasdaq_stocks", lambda logger, **filters: asked.update(filters) or ["AAA"])
+    monkeypatch.setattr(main, "scan_tickers", lambda app, tickers, *args: tickers)
+
+    assert main.process_data(None, "fetch_nasdaq_stocks", "USD", "60 D", "1 day", None, 500_000, 5000) == ["AAA"]
+    assert asked == {"sectors": None, "exclude_sectors": ["Utilities"], "min_market_cap": 300e6}
@@ -0,0 +1,83 @@
+import numpy as np
+
+import indicators as ind
+import monitor
+from bars import Bar
+from trade_data import HistoricalRequest
+
+
+class FakeApp:
+    """Answers subscriptions with preset bars; a request it drops from `requests` is dead."""
+
+    def __init__(self, bars):
+        self.bars = bars
+        self.requests = {}
+        self.next_id = 0
+        self.subscribed = 0
+
+    def subscribe_historical_data(self, symbol, currency, duration, bar_size, on_update, exchange_type=None):
+        self.next_id += 1
+        self.subscribed += 1
+        request = HistoricalRequest(self.next_id, symbol, on_update)
+        for bar in self.bars:
+            request.bars.append(bar)
+        if self.bars:
+            self.requests[request.req_id] = request
+        return request
+
+    def unsubscribe(self, request):
+        self.requests.pop(request.req_id, None)
+
+
+class FakeTracker:
+    def __init__(self):
+        self.closed = []
+
+    def update_close_info(self, ticker, **close):
+        self.closed.append(ticker)
+
+
+def rising_bars(days):
+    closes = 10 * np.exp(np.linspace(0, 0.5, days))
+    return [Bar(f"2024{i // 28 + 1:02d}{i % 28 + 1:02d}", c, c, c, c, 1e5) for i, c in enumerate(closes)]
+
+
+def replayed(bars):
+    state = ind.RollingIndicators()
+    state.update_bars(bars)
+    return state
+
+
+def watched(bars, monkeypatch):
+    # Seed from the bars themselves rather than the bar store
+    monkeypatch.setattr(monitor, "seed_indicators", lambda ticker, currency, bar_size, bars: replayed(bars[:-1]))
+    app = FakeApp(bars)
+    position_monitor = monitor.PositionMonitor(app, "AUD", tracker=FakeTracker())
+    position_monitor.watch({"ticker": "AAA", "open_date": "2024-01-01"})
+    return app, position_monitor
+
+
+def test_dead_subscription_is_renewed(monkeypatch):
+    bars = rising_bars(60)
+    app, position_monitor = watched(bars[:50], monkeypatch)
+
+    app.requests.clear()  # IB ended the subscription
+    app.bars = bars
+    position_monitor.check_subscriptions()
+
+    assert app.subscribed == 2
+    assert position_monitor.subscriptions["AAA"].req_id in app.requests
+    assert position_monitor.windows["AAA"].indicators.last_date == bars[-2].date
+    assert position_monitor.windows["AAA"].forming == bars[-1]
+
+
+def test_subscription_that_keeps_dying_is_dropped(monkeypatch):
+    app, position_monitor = watched(rising_bars(50), monkeypatch)
+
+    app.bars = []  # every renewal fails straight away
+    for _ in range(monitor.RESUBSCRIBE_ATTEMPTS + 1):
+        app.requests.clear()
+        position_monitor.check_subscriptions()
+
+    assert "AAA" not in position_monitor.windows
+    assert app.subscribed == 1 + monitor.RESUBSCRIBE_ATTEMPTS
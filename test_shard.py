@@ -0,0 +1,68 @@
+import os
+import sqlite3
+
+import pytest
+
+import bar_store
+import pacing
+import shard
+import track_recommedations as tr
+
+TICKERS = 40
+
+
+class FilePool:
+    """A connection per checkout, so forked shard processes never share one."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def getconn(self):
+        return sqlite3.connect(self.path)
+
+    def putconn(self, conn, close=False):
+        conn.close()
+
+
+def fake_gateway(port, client_id):
+    import benchmark
+    return benchmark.FakeGateway(latency=0.001)
+
+
+@pytest.fixture
+def isolated(tmp_path, monkeypatch):
+    # main, imported by the shards, logs to the working directory
+    monkeypatch.chdir(tmp_path)
+    import benchmark
+
+    benchmark.isolate(str(tmp_path))
+    tr.use_pool(FilePool(str(tmp_path / "tracked.sqlite")))
+    tr.initialize_db()
+    benchmark.write_listing(TICKERS)
+    pacing.configure(pacing.IB_HISTORICAL, 1_000_000, 1)
+    yield tmp_path
+    bar_store.close()
+    tr.use_pool(None)
+
+
+def test_sharded_scan_with_fake_gateway(isolated):
+    written = shard.run([("fetch_asx_stocks", "AUD")], "120 D", "1 day", 500000, 5000, "rules",
+                        shards_per_exchange=2, processes=2, app_factory=fake_gateway)
+
+    # Each shard wrote its own store, and both were merged into the default one
+    assert all(os.path.exists(shard.store_path(job)) for job in shard.plan([("fetch_asx_stocks", "AUD")], 2))
+    assert len(bar_store.load_all("AUD", "1 day")) == TICKERS
+    assert bar_store.load_state("B0000", "AUD", "1 day") is not None
+
+    assert written > 0
+    assert written == len(tr.get_open_positions())
+
+
+def test_open_positions_checked_once_per_currency(monkeypatch):
+    import fetch_data
+    for exchange in ("fetch_asx_stocks", "fetch_nasdaq_stocks", "fetch_nyse_stocks"):
+        monkeypatch.setattr(fetch_data, exchange, lambda logger, **filters: ["AAA", "BBB"], raising=False)
+    jobs = shard.plan([("fetch_asx_stocks", "AUD"), ("fetch_nasdaq_stocks", "USD"), ("fetch_nyse_stocks", "USD")], 2)
+
+    checking = [(job["exchange"], job["shard"]) for job in jobs if job["check_open_positions"]]
+    assert checking == [("fetch_asx_stocks", 0), ("fetch_nasdaq_stocks", 0)]
@@ -0,0 +1,107 @@
+import sqlite3
+
+import pytest
+
+import metrics
+import track_recommedations as tr
+
+
+@pytest.fixture(autouse=True)
+def sqlite_db():
+    tr.use_pool(tr.SingleConnectionPool(sqlite3.connect(":memory:", check_same_thread=False)))
+    tr.initialize_db()
+    metrics.reset()
+    yield
+    tr.use_pool(None)
+
+
+def rows():
+    with tr.connection() as conn:
+        return conn.execute("SELECT ticker, open_price, close_price FROM tracked_stocks ORDER BY ticker").fetchall()
+
+
+def writes(op):
+    return dict(metrics._counters).get(("db_writes_total", (("op", op),)), 0)
+
+
+def test_batch_open_close_reopen():
+    batch = tr.TrackingBatch()
+    batch.track_stock("AAA", "STAGE2", 1.0, "2025-01-01", 1.0)
+    batch.track_stock("BBB", "STAGE2", 2.0, "2025-01-01", 2.0)
+    assert batch.flush() == 2
+    assert writes("open") == 2
+
+    batch.update_close_info("AAA", "2025-02-01", 1.5, "2025-01-30", 1.4)
+    assert batch.flush() == 1
+    assert rows() == [("AAA", 1.0, 1.5), ("BBB", 2.0, None)]
+
+    # AAA was closed so it re-opens, BBB is still open so it is skipped
+    batch.track_stock("AAA", "STAGE2", 3.0, "2025-03-01", 3.0)
+    batch.track_stock("BBB", "STAGE2", 4.0, "2025-03-01", 4.0)
+    assert batch.flush() == 1
+    assert rows() == [("AAA", 3.0, None), ("BBB", 2.0, None)]
+    assert writes("open") == 3
+    assert len(batch) == 0
+    assert {rec["ticker"] for rec in tr.get_open_positions()} == {"AAA", "BBB"}
+
+
+def test_batch_close_of_unknown_ticker_writes_nothing():
+    batch = tr.TrackingBatch()
+    batch.update_close_info("ZZZ", "2025-02-01", 1.5, "2025-01-30", 1.4)
+    assert batch.flush() == 0
+    assert writes("close") == 0
+
+
+def test_track_stock_reopens_closed_position():
+    tr.track_stock("AAA", "STAGE2", 1.0, "2025-01-01", 1.0)
+    tr.track_stock("AAA", "STAGE2", 2.0, "2025-01-02", 2.0)
+    assert rows() == [("AAA", 1.0, None)]
+
+    tr.update_close_info("AAA", "2025-02-01", 1.5, "2025-01-30", 1.4)
+    tr.track_stock("AAA", "STAGE2", 3.0, "2025-03-01", 3.0)
+    assert rows() == [("AAA", 3.0, None)]
+    assert writes("open") == 2
+    assert writes("close") == 1
+
+
+class DroppedConnection:
+    """A pooled connection the server closed while idle: every call fails, rollback included."""
+    __module__ = "sqlite3"  # so the tracker picks sqlite3's error classes, as it would psycopg2's
+    closed = 2
+
+    def cursor(self):
+        return self
+
+    def execute(self, *args):
+        raise sqlite3.OperationalError("server closed the connection unexpectedly")
+
+    def rollback(self):
+        raise sqlite3.InterfaceError("connection already closed")
+
+
+class StalePool:
+    """Hands out the dropped connection first, then a working one."""
+
+    def __init__(self, conn):
+        self.conns = [DroppedConnection(), conn]
+        self.returned = []
+
+    def getconn(self):
+        return self.conns.pop(0) if len(self.conns) > 1 else self.conns[0]
+
+    def putconn(self, conn, close=False):
+        self.returned.append((type(conn).__name__, close))
+
+
+def test_flush_retries_on_a_fresh_connection():
+    with tr.connection() as conn:
+        pool = StalePool(conn)
+    tr.use_pool(pool)
+    tr._initialized = True
+
+    batch = tr.TrackingBatch()
+    batch.track_stock("AAA", "STAGE2", 1.0, "2025-01-01", 1.0)
+    assert batch.flush() == 1
+    # The dropped connection is closed, not handed back to the pool
+    assert pool.returned == [("DroppedConnection", True), ("Connection", False)]
+    assert rows() == [("AAA", 1.0, None)]
@@ -1,7 +1,10 @@
-import psycopg2
+import sys
+from contextlib import contextmanager
 from datetime import datetime
 from dotenv import load_dotenv
 
+import metrics
+
 load_dotenv()
 
 
@@ -10,43 +13,141 @@ PASSWORD = "E@M0nSkyl@r!8"
 HOST = "aws-0-ap-southeast-2.pooler.supabase.com"
 PORT = 6543
 DBNAME = "postgres"
+MAX_CONNECTIONS = 4
+FLUSH_ATTEMPTS = 2  # a flush that lost its connection is retried once on a fresh one
 
-def initialize_db():
-    # Connect to the database
-    try:
-        conn = psycopg2.connect(
+_pool = None
+_initialized = False
+
+# tracked_stocks keeps one row per ticker, so re-opening a closed ticker reuses its row:
+# the open columns are replaced and the close columns cleared. A ticker that is still
+# open is left alone.
+OPEN_SQL = """
+    INSERT INTO tracked_stocks (ticker, open_date, open_price, open_crossover_date, open_crossover_price)
+    VALUES {values}
+    ON CONFLICT (ticker) DO UPDATE SET
+        open_date = excluded.open_date,
+        open_price = excluded.open_price,
+        open_crossover_date = excluded.open_crossover_date,
+        open_crossover_price = excluded.open_crossover_price,
+        close_date = NULL,
+        close_price = NULL,
+        close_crossover_date = NULL,
+        close_crossover_price = NULL
+    WHERE tracked_stocks.close_date IS NOT NULL
+"""
+
+
+class SingleConnectionPool:
+    """
+    getconn/putconn wrapper around one DB-API connection, so a local stand-in
+    such as sqlite3.connect(":memory:") can replace the Postgres pool.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def getconn(self):
+        return self.conn
+
+    def putconn(self, conn, close=False):
+        pass
+
+
+def use_pool(connection_pool):
+    """Routes every query through connection_pool instead of the Supabase Postgres pool."""
+    global _pool, _initialized
+    _pool = connection_pool
+    _initialized = False
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        # Deferred, so a run on a local stand-in pool never loads psycopg2
+        from psycopg2.pool import ThreadedConnectionPool
+
+        _pool = ThreadedConnectionPool(
+            1, MAX_CONNECTIONS,
             user=USER,
             password=PASSWORD,
             host=HOST,
             port=PORT,
             dbname=DBNAME
         )
-        print("Connection successful!")
+        print("Connection pool created!")
+    return _pool
 
-        # Create a cursor to execute SQL queries
-        cursor = conn.cursor()
 
-        # Create tables if they don't exist
-        cursor.execute('''
-                CREATE TABLE IF NOT EXISTS tracked_stocks (
-                    ticker TEXT PRIMARY KEY,
-                    open_date TIMESTAMP,
-                    close_date TIMESTAMP,
-                    open_price DOUBLE PRECISION,
-                    close_price DOUBLE PRECISION,
-                    open_crossover_date TIMESTAMP,
-                    close_crossover_date TIMESTAMP,
-                    open_crossover_price DOUBLE PRECISION,
-                    close_crossover_price DOUBLE PRECISION
-                )
-            ''')
+@contextmanager
+def connection():
+    """
+    Borrows a pooled connection, rolling back anything left uncommitted on the way out.
+    A connection the server dropped is closed instead of going back to the pool.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        broken = bool(getattr(conn, "closed", False))
+        if not broken:
+            try:
+                conn.rollback()
+            except _errors(conn):
+                broken = True
+        pool.putconn(conn, close=broken)
+
+
+def _is_sqlite(conn):
+    return type(conn).__module__.startswith("sqlite3")
+
+
+def _errors(conn):
+    """The DB-API Error base class of conn's driver, psycopg2.Error or sqlite3.Error."""
+    return sys.modules[type(conn).__module__.split(".")[0]].Error
+
+
+def _connection_errors(conn):
+    """The driver's errors for a lost or unusable connection, worth a retry on another one."""
+    driver = sys.modules[type(conn).__module__.split(".")[0]]
+    return (driver.OperationalError, driver.InterfaceError)
+
+
+def _sql(conn, query):
+    # sqlite3 uses qmark placeholders where psycopg2 uses %s
+    return query.replace("%s", "?") if _is_sqlite(conn) else query
 
-        conn.commit()
-        conn.close()
 
-        # Close the cursor and connection
-        cursor.close()
-        print("Connection closed.")
+def initialize_db():
+    global _initialized
+    if _initialized:
+        return
+
+    # Connect to the database
+    try:
+        with connection() as conn:
+            # Create a cursor to execute SQL queries
+            cursor = conn.cursor()
+
+            # Create tables if they don't exist
+            cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS tracked_stocks (
+                        ticker TEXT PRIMARY KEY,
+                        open_date TIMESTAMP,
+                        close_date TIMESTAMP,
+                        open_price DOUBLE PRECISION,
+                        close_price DOUBLE PRECISION,
+                        open_crossover_date TIMESTAMP,
+                        close_crossover_date TIMESTAMP,
+                        open_crossover_price DOUBLE PRECISION,
+                        close_crossover_price DOUBLE PRECISION
+                    )
+                ''')
+
+            conn.commit()
+            cursor.close()
+        _initialized = True
 
     except Exception as e:
         print(f"Failed to connect: {e}")
@@ -63,57 +164,47 @@ def get_latest_price(ticker):
 
 # Function to add a stock to track (open or close)
 
+@metrics.timed("db_seconds", op="track_stock")
 def track_stock(ticker, stage, price, open_cross_date, open_cross_price):
     initialize_db()
-    conn = psycopg2.connect(
-            user=USER,
-            password=PASSWORD,
-            host=HOST,
-            port=PORT,
-            dbname=DBNAME
-        )
-    print("Connection successful!")
-    cursor = conn.cursor()
     today = datetime.now().strftime('%Y-%m-%d')
     stage = stage.lower()
 
-    try:
-        cursor.execute('''
-            SELECT open_date, close_date, close_price 
-            FROM tracked_stocks
-            WHERE ticker = %s
-            ORDER BY open_date DESC
-            LIMIT 1
-        ''', (ticker,))
-        last_entry = cursor.fetchone()
-
-        # If there is no entry inside the table and stock is stage2 just insert
-        if last_entry is None:
-            if stage == 'stage2':
-                cursor.execute('''
-                    INSERT INTO tracked_stocks (ticker, open_date, open_price, open_crossover_date, open_crossover_price)
-                    VALUES (%s, %s, %s, %s, %s)
-                ''', (ticker, today, price, open_cross_date, open_cross_price))
-            else:
-                print(f"{ticker}: Stage {stage[-1]} but no existing position — skipping.")
+    with connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(_sql(conn, '''
+                SELECT open_date, close_date, close_price 
+                FROM tracked_stocks
+                WHERE ticker = %s
+                ORDER BY open_date DESC
+                LIMIT 1
+            '''), (ticker,))
+            last_entry = cursor.fetchone()
 
-        else:
-            # We have found an existing entry.
-            # This entry had been in stage2 and left stage2 so we closed it off previously. We can add another entry in.
-            id, _, close_date, close_price = last_entry
-            if stage == 'stage2':
-                if close_date is not None and close_price is not None:
-                    cursor.execute('''
-                        INSERT INTO tracked_stocks (ticker, open_date, open_price, open_crossover_date, open_crossover_price)
-                        VALUES (%s, %s, %s, %s, %s)
-                    ''', (ticker, today, price, open_cross_date, open_cross_price))
+            # If there is no entry inside the table and stock is stage2 just insert
+            if last_entry is None:
+                if stage == 'stage2':
+                    cursor.execute(_sql(conn, OPEN_SQL.format(values="(%s, %s, %s, %s, %s)")),
+                                   (ticker, today, price, open_cross_date, open_cross_price))
+                    metrics.inc("db_writes_total", op="open")
                 else:
-                    print(f"{ticker}: Already has open position — skipping Stage 2 insert.")
-        conn.commit()
-    except psycopg2.Error as e:
-        print(f"An error occurred: {e}")
-    finally:
-        conn.close()
+                    print(f"{ticker}: Stage {stage[-1]} but no existing position — skipping.")
+
+            else:
+                # We have found an existing entry.
+                # This entry had been in stage2 and left stage2 so we closed it off previously. We can add another entry in.
+                _, close_date, close_price = last_entry
+                if stage == 'stage2':
+                    if close_date is not None and close_price is not None:
+                        cursor.execute(_sql(conn, OPEN_SQL.format(values="(%s, %s, %s, %s, %s)")),
+                                       (ticker, today, price, open_cross_date, open_cross_price))
+                        metrics.inc("db_writes_total", op="open")
+                    else:
+                        print(f"{ticker}: Already has open position — skipping Stage 2 insert.")
+            conn.commit()
+        except _errors(conn) as e:
+            print(f"An error occurred: {e}")
 
     """
     Retrieve all currently open stock positions from the 'tracked_stocks' PostgreSQL table.
@@ -130,20 +221,13 @@ def track_stock(ticker, stage, price, open_cross_date, open_cross_price):
             - 'open_crossover_price': The close price on the crossover date
     """
 def get_open_positions():
-    conn = psycopg2.connect(
-            user=USER,
-            password=PASSWORD,
-            host=HOST,
-            port=PORT,
-            dbname=DBNAME
-        )
-    print("Connection successful!")
-    c = conn.cursor()
-    c.execute("SELECT ticker, open_date, open_crossover_date, open_crossover_price FROM tracked_stocks WHERE close_date IS NULL AND close_price IS NULL")
-    rows = c.fetchall()
-    conn.close()
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT ticker, open_date, open_crossover_date, open_crossover_price FROM tracked_stocks WHERE close_date IS NULL AND close_price IS NULL")
+        rows = c.fetchall()
     return [{"ticker": row[0], "open_date": row[1], "open_crossover_date": row[2], "open_crossover_price": row[3]} for row in rows]
 
+@metrics.timed("db_seconds", op="update_close_info")
 def update_close_info(ticker, close_date, close_price, close_crossover_date, close_crossover_price):
     """
     Update the close information for an open position in the 'tracked_stocks' table.
@@ -158,29 +242,134 @@ def update_close_info(ticker, close_date, close_price, close_crossover_date, clo
     Notes:
         Only updates rows where 'close_date' is currently NULL (i.e., still open).
     """
-    # Connect to the PostgreSQL database
-    conn = psycopg2.connect(
-        user=USER,
-        password=PASSWORD,
-        host=HOST,
-        port=PORT,
-        dbname=DBNAME
-    )
-    print("Connection successful!")
-
-    # Create a cursor object
-    c = conn.cursor()
-
-    # Execute the update query using %s placeholders (correct for psycopg2)
-    c.execute("""
-        UPDATE tracked_stocks
-        SET close_date = %s,
-            close_price = %s,
-            close_crossover_date = %s,
-            close_crossover_price = %s
-        WHERE ticker = %s AND close_date IS NULL
-    """, (close_date, close_price, close_crossover_date, close_crossover_price, ticker))
-
-    # Commit the transaction and close the connection
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    with connection() as conn:
+        # Create a cursor object
+        c = conn.cursor()
+
+        # Execute the update query using %s placeholders (correct for psycopg2)
+        c.execute(_sql(conn, """
+            UPDATE tracked_stocks
+            SET close_date = %s,
+                close_price = %s,
+                close_crossover_date = %s,
+                close_crossover_price = %s
+            WHERE ticker = %s AND close_date IS NULL
+        """), (close_date, close_price, close_crossover_date, close_crossover_price, ticker))
+
+        # Commit the transaction
+        conn.commit()
+        metrics.inc("db_writes_total", c.rowcount, op="close")
+
+
+class TrackingBatch:
+    """
+    Collects a run's Stage 2 opens and closes and writes them in a single transaction.
+    Has the same track_stock/update_close_info methods as this module, so either can
+    be passed wherever a tracker is expected.
+    """
+
+    def __init__(self):
+        self.opens = {}  # ticker -> insert row
+        self.closes = {}  # ticker -> update row
+
+    def __len__(self):
+        return len(self.opens) + len(self.closes)
+
+    def track_stock(self, ticker, stage, price, open_cross_date, open_cross_price):
+        if stage.lower() != 'stage2':
+            print(f"{ticker}: Stage {stage[-1]} but no existing position — skipping.")
+            return
+        today = datetime.now().strftime('%Y-%m-%d')
+        self.opens[ticker] = (ticker, today, price, open_cross_date, open_cross_price)
+
+    def update_close_info(self, ticker, close_date, close_price, close_crossover_date, close_crossover_price):
+        self.closes[ticker] = (ticker, close_date, close_price, close_crossover_date, close_crossover_price)
+
+    @metrics.timed("db_seconds", op="flush")
+    def flush(self):
+        """
+        Applies the queued closes, then the queued opens for tickers without an open
+        position, re-opening closed ones. A transaction that lost its connection is
+        retried once on a fresh one, and queued rows are kept if it still fails so flush
+        can be called again.
+
+        Returns:
+            int: The number of rows written: positions closed plus positions opened.
+        """
+        if not len(self):
+            return 0
+
+        initialize_db()
+        for attempt in range(1, FLUSH_ATTEMPTS + 1):
+            with connection() as conn:
+                try:
+                    closed, opened = self._write(conn)
+                    break
+                except _connection_errors(conn) as e:
+                    if attempt == FLUSH_ATTEMPTS:
+                        print(f"An error occurred: {e}")
+                        return 0
+                    print(f"Lost the database connection ({e}), retrying on a fresh one")
+                except _errors(conn) as e:
+                    print(f"An error occurred: {e}")
+                    return 0
+        metrics.inc("db_writes_total", closed, op="close")
+        metrics.inc("db_writes_total", opened, op="open")
+
+        self.opens.clear()
+        self.closes.clear()
+        return closed + opened
+
+    def _write(self, conn):
+        """Writes the queued closes and opens in one transaction, returns (closed, opened)."""
+        closed = opened = 0
+        cursor = conn.cursor()
+        if self.closes:
+            closed = self._write_closes(conn, cursor, list(self.closes.values()))
+
+        if self.opens:
+            cursor.execute("SELECT ticker FROM tracked_stocks WHERE close_date IS NULL")
+            already_open = {row[0] for row in cursor.fetchall()}
+            rows = [row for ticker, row in self.opens.items() if ticker not in already_open]
+            for ticker in already_open.intersection(self.opens):
+                print(f"{ticker}: Already has open position — skipping Stage 2 insert.")
+            if rows:
+                opened = self._write_opens(conn, cursor, rows)
+
+        conn.commit()
+        return closed, opened
+
+    @staticmethod
+    def _write_opens(conn, cursor, rows):
+        """Writes the open rows and returns how many were inserted or re-opened."""
+        if _is_sqlite(conn):
+            # sqlite3 sums rowcount over executemany, and can't return rows from it
+            cursor.executemany(OPEN_SQL.format(values="(?, ?, ?, ?, ?)"), rows)
+            return cursor.rowcount
+        else:
+            from psycopg2.extras import execute_values
+            return len(execute_values(cursor, OPEN_SQL.format(values="%s") + " RETURNING ticker", rows, fetch=True))
+
+    @staticmethod
+    def _write_closes(conn, cursor, rows):
+        """Writes the close rows and returns how many open positions they closed."""
+        if _is_sqlite(conn):
+            cursor.executemany("""
+                UPDATE tracked_stocks
+                SET close_date = ?, close_price = ?, close_crossover_date = ?, close_crossover_price = ?
+                WHERE ticker = ? AND close_date IS NULL
+            """, [(*row[1:], row[0]) for row in rows])
+            return cursor.rowcount
+        else:
+            from psycopg2.extras import execute_values
+            closed = execute_values(cursor, """
+                UPDATE tracked_stocks AS t
+                SET close_date = v.close_date,
+                    close_price = v.close_price,
+                    close_crossover_date = v.close_crossover_date,
+                    close_crossover_price = v.close_crossover_price
+                FROM (VALUES %s) AS v(ticker, close_date, close_price, close_crossover_date, close_crossover_price)
+                WHERE t.ticker = v.ticker AND t.close_date IS NULL
+                RETURNING t.ticker
+            """, rows, template="(%s, %s::timestamp, %s::double precision, %s::timestamp, %s::double precision)", fetch=True)
+            return len(closed)
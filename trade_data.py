@@ -3,16 +3,51 @@ from ibapi.wrapper import *
 port = 4002
 import threading
 import datetime as dt
-import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import pacing
+from bars import BarArray
 
 # Ensure the same logger is used
 logger = logging.getLogger('main')  # This should match the logger name from main.py
 
+# IB rejects more than 50 simultaneous open historical data requests
+MAX_HISTORICAL_IN_FLIGHT = 50
+HISTORICAL_TIMEOUT = 10  # seconds to wait for a single request
+# Failures worth retrying: not connected, connectivity lost, and 162 pacing violations
+# (162 is also sent for "no data", which is final)
+TRANSIENT_ERRORS = {504, 1100}
+
+
+class HistoricalDataError(Exception):
+    """A historical request failed for a transient reason: a pacing violation, a lost connection or a timeout."""
+
+
+def is_transient(error_code, error_string):
+    return error_code in TRANSIENT_ERRORS or (error_code == 162 and "pacing" in error_string.lower())
+
+
+class HistoricalRequest:
+    """
+    Bar buffer and completion future for one in-flight reqHistoricalData. Streaming
+    (keepUpToDate) requests also have an on_update callback and stay registered
+    after the initial bars complete the future.
+    """
+
+    def __init__(self, req_id, symbol, on_update=None):
+        self.req_id = req_id
+        self.symbol = symbol
+        self.bars = BarArray()
+        self.future = Future()
+        self.on_update = on_update
+        self.error = None  # why a transient failure ended the request
+
+
 class IBKR(EClient, EWrapper):
     def __init__(self):
         EClient.__init__(self, self)
         self.valid_id_received = threading.Event()
-        self.data = []
+        self.requests = {}  # reqId -> HistoricalRequest
         self.orderId = None
         self.lock = threading.Lock()
 
@@ -26,34 +61,108 @@ class IBKR(EClient, EWrapper):
             return self.orderId
 
     def historicalData(self, reqId, bar):
-        self.data.append(bar)
+        request = self.requests.get(reqId)
+        if request is not None:
+            request.bars.append(bar)
 
     def historicalDataEnd(self, reqId, start, end):
-        self.done.set()
+        request = self.requests.get(reqId)
+        if request is not None and request.on_update is not None:
+            # Subscriptions stay registered to receive historicalDataUpdate
+            if not request.future.done():
+                request.future.set_result(request.bars)
+        else:
+            self._finish(reqId)
 
-    def get_historical_data(self, symbol, currency, duration, bar_size):
-        self.data = []  # Clear previous data
-        self.done = threading.Event()
+    def historicalDataUpdate(self, reqId, bar):
+        # The latest (still forming) bar, resent as it changes; a new date means the previous bar closed
+        request = self.requests.get(reqId)
+        if request is not None and request.on_update is not None:
+            request.on_update(bar)
 
+    def error(self, reqId, *args):
+        # ibapi has changed this signature between releases, so pick the code and message out by type
+        super().error(reqId, *args)
+        error_code = next((a for a in reversed(args) if isinstance(a, int)), None)
+        error_string = next((a for a in args if isinstance(a, str)), "")
+
+        # 2100-2199 are informational farm/connection notices, not request failures
+        if reqId in self.requests and not (error_code is not None and 2100 <= error_code < 2200):
+            logger.warning(f"Historical request {reqId} ({self.requests[reqId].symbol}) failed: {error_code} {error_string}")
+            if is_transient(error_code, error_string):
+                self.requests[reqId].error = f"{error_code} {error_string}"
+            self._finish(reqId)
+
+    def _finish(self, reqId):
+        # Whoever pops the request first (end, error or timeout) resolves its future
+        request = self.requests.pop(reqId, None)
+        if request is not None and not request.future.done():
+            request.future.set_result(request.bars)
+        return request
+
+    def _cancel(self, request):
+        if self._finish(request.req_id) is not None:
+            request.error = request.error or "timed out"
+            logger.warning(f"Historical request {request.req_id} ({request.symbol}) timed out")
+            self.cancelHistoricalData(request.req_id)
+
+    def _submit(self, symbol, currency, duration, bar_size, exchange_type=None, on_update=None):
         contract = Contract()
         contract.symbol = symbol
         contract.secType = "STK"
         contract.exchange = "SMART"
         contract.currency = currency
+        if exchange_type:
+            contract.primaryExchange = exchange_type
+
+        pacing.acquire(pacing.IB_HISTORICAL)
+        request = HistoricalRequest(self.nextId(), symbol, on_update)
+        # Register before sending so no callback can arrive for an unknown reqId
+        self.requests[request.req_id] = request
 
-        now = dt.datetime.now().strftime('%Y%m%d %H:%M:%S Australia/Sydney')
-        self.reqHistoricalData(self.nextId(), contract, now, duration, bar_size, "TRADES", 1, 1, False, [])
+        keep_up_to_date = on_update is not None
+        # IB requires an empty end date for keepUpToDate requests
+        end = "" if keep_up_to_date else dt.datetime.now().strftime('%Y%m%d %H:%M:%S Australia/Sydney')
+        self.reqHistoricalData(request.req_id, contract, end, duration, bar_size, "TRADES", 1, 1, keep_up_to_date, [])
+        return request
+
+    def get_historical_data(self, symbol, currency, duration, bar_size, exchange_type=None):
+        request = self._submit(symbol, currency, duration, bar_size, exchange_type)
 
         # Wait until data is received or timeout
-        self.done.wait(timeout=10)
-        return self.data
+        try:
+            request.future.result(timeout=HISTORICAL_TIMEOUT)
+        except FutureTimeoutError:
+            self._cancel(request)
+        if request.error:
+            raise HistoricalDataError(f"{symbol}: {request.error}")
+        return request.bars
+
+    def subscribe_historical_data(self, symbol, currency, duration, bar_size, on_update, exchange_type=None):
+        """
+        Requests the duration window with keepUpToDate, then calls on_update(bar) from the
+        reader thread each time IB updates the latest bar.
+
+        Returns:
+            HistoricalRequest: its bars hold the initial window once it completes. Pass it
+            to unsubscribe() to stop the updates.
+        """
+        request = self._submit(symbol, currency, duration, bar_size, exchange_type, on_update)
+        try:
+            request.future.result(timeout=HISTORICAL_TIMEOUT)
+        except FutureTimeoutError:
+            logger.warning(f"Subscription {request.req_id} ({symbol}) has no initial bars yet")
+        return request
+
+    def unsubscribe(self, request):
+        if self._finish(request.req_id) is not None:
+            self.cancelHistoricalData(request.req_id)
 
 if __name__ == "__main__":
     app = IBKR()
     app.connect("127.0.0.1", port, clientId=123)
     threading.Thread(target=app.run, daemon=True).start()
-    time.sleep(1)
+    app.valid_id_received.wait(timeout=5)
 
-    for i in range(5):
-        app.get_historical_data("MQG", "AUD", "1 D", "1 hour")
-        print(app.data)
\ No newline at end of file
+    for symbol in ["MQG", "CBA", "BHP", "WBC", "NAB"]:
+        print(symbol, app.get_historical_data(symbol, "AUD", "1 D", "1 hour"))
@@ -0,0 +1,146 @@
+import json
+import os
+import time
+from io import StringIO
+
+import pandas as pd
+
+# Exchange listings cached on disk with ETag/age based refresh. Each listing is
+# normalised to symbol, name, sector, industry and market_cap columns so cheap
+# filters can shrink the universe before any IB request, and a cached snapshot
+# is used when the exchange can't be reached. The ASX listing only has a GICS industry
+# group, so ASX stocks have no sector and no market cap.
+
+UNIVERSE_DIR = os.getenv("UNIVERSE_DIR", "cache/universe")
+MAX_AGE = 24 * 60 * 60  # seconds before a snapshot is revalidated with the exchange
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36"
+}
+
+COLUMNS = ["symbol", "name", "sector", "industry", "market_cap"]
+
+
+def _parse_asx(text):
+    # Codes such as "NA" are real tickers, not missing values
+    df = pd.read_csv(StringIO(text), skiprows=1, keep_default_na=False, na_values=[""])
+    return pd.DataFrame({
+        "symbol": df["ASX code"],
+        "name": df["Company name"],
+        "sector": None,
+        "industry": df["GICS industry group"],
+        "market_cap": float("nan"),
+    })
+
+
+def _parse_nasdaq(text):
+    df = pd.DataFrame(json.loads(text).get('data').get('table').get('rows', []))
+    return pd.DataFrame({
+        "symbol": df["symbol"],
+        "name": df["name"],
+        "sector": df["sector"],
+        "industry": df["industry"],
+        "market_cap": pd.to_numeric(df["marketCap"].astype(str).str.replace(",", ""), errors="coerce"),
+    }).sort_values("symbol")
+
+
+SOURCES = {
+    "asx": {
+        "url": "https://www.asx.com.au/asx/research/ASXListedCompanies.csv",
+        "params": None,
+        "parse": _parse_asx,
+    },
+    "nasdaq": {
+        "url": "https://api.nasdaq.com/api/screener/stocks",
+        "params": {"limit": 4050, "exchange": "nasdaq"},
+        "parse": _parse_nasdaq,
+    },
+}
+
+
+def _paths(exchange):
+    return os.path.join(UNIVERSE_DIR, f"{exchange}.csv"), os.path.join(UNIVERSE_DIR, f"{exchange}.json")
+
+
+def _read_snapshot(exchange):
+    snapshot_path, meta_path = _paths(exchange)
+    if not os.path.exists(snapshot_path):
+        return None, {}
+    meta = {}
+    if os.path.exists(meta_path):
+        with open(meta_path) as file:
+            meta = json.load(file)
+    return pd.read_csv(snapshot_path, keep_default_na=False, na_values=[""]), meta
+
+
+def _write_meta(exchange, meta):
+    with open(_paths(exchange)[1], "w") as file:
+        json.dump(meta, file)
+
+
+def load(exchange, logger, max_age=MAX_AGE):
+    """
+    Returns the exchange listing as a DataFrame with COLUMNS, served from the local
+    snapshot while it is younger than max_age, revalidated with an ETag/Last-Modified
+    request after that, and from the stale snapshot if the exchange can't be reached.
+    """
+    source = SOURCES[exchange]
+    snapshot, meta = _read_snapshot(exchange)
+    if snapshot is not None and time.time() - meta.get("fetched_at", 0) < max_age:
+        logger.info(f"Using cached {exchange.upper()} listing of {len(snapshot)} stocks")
+        return snapshot
+
+    headers = dict(HEADERS)
+    if snapshot is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    import requests  # deferred, only needed when a snapshot is missing or stale
+
+    try:
+        logger.info(f"Fetching {exchange.upper()} stocks data...")
+        response = requests.get(source["url"], params=source["params"], headers=headers, timeout=10)
+        if response.status_code == 304 and snapshot is not None:
+            logger.info(f"{exchange.upper()} listing unchanged, using cached snapshot")
+            _write_meta(exchange, dict(meta, fetched_at=time.time()))
+            return snapshot
+        response.raise_for_status()
+
+        df = source["parse"](response.text)
+        df = df[df["symbol"].notna()].reset_index(drop=True)
+        os.makedirs(UNIVERSE_DIR, exist_ok=True)
+        df.to_csv(_paths(exchange)[0], index=False)
+        _write_meta(exchange, {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched_at": time.time(),
+        })
+        logger.info(f"Successfully fetched {len(df)} {exchange.upper()} stocks")
+        return df
+    except Exception as e:
+        if snapshot is not None:
+            logger.warning(f"Failed to fetch {exchange.upper()} stocks ({e}), using snapshot from {time.ctime(meta.get('fetched_at', 0))}")
+            return snapshot
+        logger.error(f"Failed to fetch {exchange.upper()} stocks: {str(e)}")
+        return pd.DataFrame(columns=COLUMNS)
+
+
+def filter_universe(df, sectors=None, exclude_sectors=None, min_market_cap=None):
+    """
+    Narrows a listing by sector and market cap. Stocks with an unknown sector or
+    market cap (all of ASX) are kept, since the filter can't rule them out.
+    """
+    mask = pd.Series(True, index=df.index)
+    if sectors:
+        mask &= df["sector"].isna() | df["sector"].isin(sectors)
+    if exclude_sectors:
+        mask &= ~df["sector"].isin(exclude_sectors)
+    if min_market_cap is not None:
+        mask &= df["market_cap"].isna() | (df["market_cap"] >= min_market_cap)
+    return df[mask]
+
+
+def symbols(df):
+    return df["symbol"].astype(str).str.strip().tolist()